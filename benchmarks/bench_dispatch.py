@@ -0,0 +1,99 @@
+"""
+Per-update overhead of the two dispatch engines, the rx pipelines and the native dispatcher.
+
+Parsed updates with the message mix of bench_e2e are pushed through KoverBot.push_update,
+with the handler limiter replaced by a counter, so only the routing itself is timed: the
+filters, the trigger regexes, the skip_some counters and the handler call. Both engines are
+fed the same updates and should start the same handlers.
+
+    python -m benchmarks.bench_dispatch [chats] [updates]
+"""
+import asyncio
+import logging
+import random
+import sys
+from collections import Counter
+from time import perf_counter
+from types import SimpleNamespace
+
+import telegram
+from reactivex.subject import Subject
+
+from benchmarks.bench_e2e import MIX
+from benchmarks.standins import text_update
+from kover_bot.autopics import AutoPicScheduler
+from kover_bot.bot2 import KoverBot
+from kover_bot.chats import Chat, ChatRegistry
+from kover_bot.metrics import Metrics
+from kover_bot.outbound import Priority
+from kover_bot.rx_utils import SkipStats
+from kover_bot.settings import Settings
+
+
+class CountingHandlers:
+    """Stands in for the HandlerLimiter, counting what would be started."""
+
+    def __init__(self):
+        self.spawned = Counter()
+
+    def spawn(self, chat_id, start, priority=Priority.DIRECT, key=None):
+        self.spawned[start.func.__name__, priority.name] += 1
+
+
+def make_updates(chats: int, count: int) -> list[telegram.Update]:
+    texts = [text for _, text, _ in MIX]
+    shares = [share for share, _, _ in MIX]
+    updates = []
+    for n in range(count):
+        data = text_update(-1_000_000 - random.randrange(chats), n + 1, random.choices(texts, shares)[0]())
+        data['update_id'] = n + 1
+        updates.append(telegram.Update.de_json(data, None))
+    return updates
+
+
+async def bench(dispatcher: str, chats: int, updates: list[telegram.Update]) -> tuple[float, Counter]:
+    async def no_picture():
+        return None
+
+    async def no_send(chat_ids, picture):
+        pass
+
+    bot = KoverBot()
+    bot.settings = Settings(dispatcher=dispatcher)
+    bot.bot = SimpleNamespace(id=1000)
+    bot.metrics = Metrics(False)
+    bot.updates = Subject()
+    bot.update_id = None
+    bot.skip_stats = SkipStats()
+    bot.autopics = AutoPicScheduler(no_picture, no_send)
+    bot.handlers = CountingHandlers()
+    bot.chats = ChatRegistry()
+    for n in range(chats):
+        bot.chats.add(Chat(-1_000_000 - n, f'chat{n}'))
+    await bot._setup()
+
+    started = perf_counter()
+    for update in updates:
+        bot.push_update(update)
+    elapsed = perf_counter() - started
+
+    if bot.dispatcher:
+        bot.dispatcher.close()
+    return elapsed / len(updates), bot.handlers.spawned
+
+
+def main(chats=200, count=100_000):
+    logging.getLogger('root').setLevel(logging.WARNING)
+    chats, count = int(chats), int(count)
+    updates = make_updates(chats, count)
+    print(f"{chats} chats, {count} updates")
+    print(f"{'engine':>8}{'us/update':>12}{'handlers':>10}")
+    for dispatcher in ('rx', 'native'):
+        per_update, spawned = asyncio.run(bench(dispatcher, chats, updates))
+        print(f"{dispatcher:>8}{per_update * 1e6:>12.2f}{sum(spawned.values()):>10}")
+        for (name, priority), n in sorted(spawned.items()):
+            print(f"{'':>8}  {name} {priority.lower()}: {n}")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
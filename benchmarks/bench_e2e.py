@@ -0,0 +1,139 @@
+"""
+End-to-end throughput and reply latency of the bot, run against local stand-ins for svalko.org,
+baneks.ru and the Telegram Bot API.
+
+A stream of synthetic group messages across many chats is fed to KoverBot.run through getUpdates,
+mixing plain chatter with messages the bot answers (анекдот, #tag, /kament, ковробот). Latency is
+the time from an update being queued on the fake Telegram to the bot's send for it, matched per
+chat in order. The stand-ins run on their own event loop in a thread so they do not compete with
+the bot's loop, but they share the process, so peak RSS is an upper bound for the bot alone.
+
+    python -m benchmarks.bench_e2e [chats] [messages] [rate] [send_interval] [send_rate] [dispatcher]
+
+rate is updates per second offered to the bot, send_interval and send_rate are passed to
+Settings and default to no outbound pacing, so that the bot itself is measured rather than
+Telegram's limits. dispatcher picks the engine routing updates, rx or native.
+"""
+import asyncio
+import logging
+import random
+import resource
+import sys
+import tempfile
+from collections import defaultdict, deque
+from statistics import quantiles
+from time import monotonic
+
+from benchmarks.standins import FIXTURES, Sent, StandIns, text_update
+from kover_bot import scrapers
+from kover_bot.bot2 import KoverBot
+from kover_bot.settings import Settings
+
+NOISE = ['ну да', 'а вот и нет', 'кто здесь', 'сегодня пятница', 'ахаха', 'лол']
+TAGS = [tag.name for tag in scrapers.parse_tags((FIXTURES / 'tags.html').read_bytes())]
+
+# share of messages of every kind, and whether the bot answers it
+MIX = [
+    (0.5, lambda: random.choice(NOISE), False),
+    (0.15, lambda: 'расскажи анекдот', True),
+    (0.1, lambda: f'#{random.choice(TAGS)}', True),
+    (0.15, lambda: '/kament', True),
+    (0.1, lambda: 'ковробот, ты тут?', True),
+]
+
+
+async def bench(chats: int, messages: int, rate: float, send_interval: float, send_rate: float,
+                dispatcher: str = 'rx'):
+    pending: dict[int, deque[float]] = defaultdict(deque)
+    latencies: list[float] = []
+    unmatched = 0
+
+    def on_send(sent: Sent):
+        nonlocal unmatched
+        queue = pending.get(sent.chat_id)
+        if queue:
+            latencies.append(sent.at - queue.popleft())
+        else:
+            unmatched += 1
+
+    standins = StandIns(on_send)
+    standins.start()
+
+    data_dir = tempfile.TemporaryDirectory()
+    settings = Settings(
+        data_dir=data_dir.name,
+        svalko_url=standins.svalko_url,
+        baneks_url=standins.baneks_url,
+        telegram_api_url=standins.telegram_url,
+        send_interval=send_interval,
+        send_rate=send_rate,
+        dispatcher=dispatcher,
+        log_level='WARNING',
+    )
+    bot = await KoverBot.create('1000:bench', settings)
+    run = asyncio.create_task(bot.run())
+
+    max_tasks = 0
+
+    async def sample_tasks():
+        nonlocal max_tasks
+        while True:
+            max_tasks = max(max_tasks, len(asyncio.all_tasks()))
+            await asyncio.sleep(0.01)
+
+    sampler = asyncio.create_task(sample_tasks())
+
+    weights = [share for share, _, _ in MIX]
+    expected = 0
+    started = monotonic()
+    for n in range(messages):
+        _, text, answered = random.choices(MIX, weights)[0]
+        chat_id = -1_000_000 - random.randrange(chats)
+        if answered:
+            pending[chat_id].append(monotonic())
+            expected += 1
+        standins.push(text_update(chat_id, n + 1, text(), user_id=random.randrange(1, 1000)))
+        delay = started + (n + 1) / rate - monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    # wait for the bot to take every update and answer them, or to make no progress for a while
+    progress, last_progress = None, monotonic()
+    while monotonic() - last_progress < 5:
+        await asyncio.sleep(0.01)
+        if (bot.update_id, len(latencies)) != progress:
+            progress, last_progress = (bot.update_id, len(latencies)), monotonic()
+        if bot.update_id == messages + 1 and len(latencies) >= expected:
+            break
+    elapsed = last_progress - started
+
+    sampler.cancel()
+    run.cancel()
+    await asyncio.gather(sampler, run, return_exceptions=True)
+    await bot.close()
+    standins.stop()
+    data_dir.cleanup()
+
+    handled = (bot.update_id or 1) - 1
+    p50, p99 = 0, 0
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100)
+        p50, p99 = percentiles[49] * 1000, percentiles[98] * 1000
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"chats {chats}, messages {messages}, offered {rate:,.0f} updates/s")
+    print(f"  updates/s        {handled / elapsed:>10,.0f}")
+    print(f"  answered         {len(latencies):>10} of {expected} ({unmatched} unmatched sends)")
+    print(f"  latency p50, ms  {p50:>10.1f}")
+    print(f"  latency p99, ms  {p99:>10.1f}")
+    print(f"  peak rss, MiB    {rss:>10.1f}")
+    print(f"  peak tasks       {max_tasks:>10}")
+
+
+def main(chats=200, messages=5000, rate=1000, send_interval=0, send_rate=1_000_000, dispatcher='rx'):
+    logging.getLogger('root').setLevel(logging.WARNING)
+    asyncio.run(bench(int(chats), int(messages), float(rate), float(send_interval), float(send_rate),
+                      dispatcher))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
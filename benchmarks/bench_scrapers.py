@@ -0,0 +1,123 @@
+"""
+Parse time and peak memory of kover_bot.scrapers against the full-tree BeautifulSoup parsing
+the bot did before. Both must extract the same values from every fixture; a mismatch is
+printed and the benchmark exits with an error.
+
+    python -m benchmarks.bench_scrapers [rounds]
+"""
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+
+from kover_bot import scrapers
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+
+def full_kaments(html):
+    soup = BeautifulSoup(html, "html.parser")
+    kaments = []
+    for comment in soup.find_all('div', {'class': 'comment'}):
+        if len(comment.text) >= 500 or not comment.text.strip():
+            continue
+        text = comment.find('div', {'class': 'text'})
+        if text and text.text.strip():
+            kaments.append(text.text)
+    return kaments
+
+
+def full_tags(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [
+        scrapers.Tag(name=tagtag.text, tag_id=tagtag.attrs['href'].replace('/tag/', ''))
+        for tagtag in soup.find_all('a', attrs={'href': scrapers.tag_href_re})
+        if tagtag.text.strip()
+    ]
+
+
+def full_tag_pages(html):
+    soup = BeautifulSoup(html, "html.parser")
+    paging = soup.find('div', attrs={'class': 'paging'})
+    if not paging or not paging.find('b'):
+        return 0
+    return int(paging.find('b').text.strip('[]'))
+
+
+def full_posts(html):
+    soup = BeautifulSoup(html, "html.parser")
+    posts = []
+    for posting in soup.find_all('div', attrs={'class': 'posting'}):
+        post = posting.find('div', attrs={'class': 'text'})
+        if not post:
+            continue
+        tags = post.find('div', attrs={'class': 'tags'})
+        if tags:
+            tags.decompose()
+        pictag = post.find('img')
+        posts.append(scrapers.Post(
+            text=post.text,
+            image_url=pictag.attrs.get('src') if pictag else None,
+        ))
+    return posts
+
+
+def full_image_names(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [
+        scrapers.image_view_re.match(pictag.attrs['href']).group(1)
+        for pictag in soup.find_all("a", {"href": scrapers.image_view_re})
+    ]
+
+
+def full_anek(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return soup.find('section', {'class': 'anek-view'}).find('p').text
+
+
+CASES = [
+    ('random.html', full_kaments, scrapers.parse_kaments),
+    ('comments.html', full_kaments, scrapers.parse_kaments),
+    ('tags.html', full_tags, scrapers.parse_tags),
+    ('tag.html', full_tag_pages, scrapers.parse_tag_pages),
+    ('page.html', full_posts, scrapers.parse_posts),
+    ('images.html', full_image_names, scrapers.parse_image_names),
+    ('anek.html', full_anek, scrapers.parse_anek),
+]
+
+
+def measure(func, html, rounds):
+    seconds = min(timeit.repeat(lambda: func(html), number=rounds, repeat=3)) / rounds
+
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, peak
+
+
+def main(rounds=20):
+    mismatches = []
+    for fixture, full, strained in CASES:
+        html = (FIXTURES / fixture).read_bytes()
+        expected, got = full(html), strained(html)
+        if got != expected:
+            mismatches.append(f"{fixture}: {strained.__name__} gave {got!r}, expected {expected!r}")
+    if mismatches:
+        sys.exit('\n'.join(mismatches))
+
+    print(f"{'fixture':<14}{'size':>9}{'full ms':>10}{'scraper ms':>11}{'full KiB':>10}{'scraper KiB':>12}")
+    for fixture, full, strained in CASES:
+        html = (FIXTURES / fixture).read_bytes()
+        full_time, full_peak = measure(full, html, rounds)
+        strained_time, strained_peak = measure(strained, html, rounds)
+        print(f"{fixture:<14}{len(html):>9}"
+              f"{full_time * 1000:>10.2f}{strained_time * 1000:>11.2f}"
+              f"{full_peak / 1024:>10.0f}{strained_peak / 1024:>12.0f}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,85 @@
+"""
+Throughput of the sharded mode by number of worker processes, against the local stand-ins.
+
+The benchmark process plays the ingest, polling the fake Telegram and fanning updates out to
+the workers, which answer through the fake Telegram as well. A burst of messages answered by
+the bot is queued at once, spread over many chats, and the time until the last reply gives the
+replies per second. The bench stops once no reply came for a while: a chat getting more
+messages at once than its handler backlog holds has some of them shed, and those are reported
+as unanswered. Scaling is bounded by the cores available; with a single core more workers only
+add overhead.
+
+    python -m benchmarks.bench_sharding [chats] [messages] [workers ...]
+"""
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+from time import monotonic
+
+from benchmarks.bench_e2e import MIX
+from benchmarks.standins import StandIns, text_update
+from kover_bot.settings import Settings
+from kover_bot.sharding import Ingest
+
+
+async def bench(chats: int, messages: int, workers: int) -> tuple[float, int]:
+    standins = StandIns(lambda sent: None)
+    standins.start()
+
+    data_dir = tempfile.TemporaryDirectory()
+    settings = Settings(
+        data_dir=data_dir.name,
+        svalko_url=standins.svalko_url,
+        baneks_url=standins.baneks_url,
+        telegram_api_url=standins.telegram_url,
+        send_interval=0,
+        send_rate=1_000_000,
+        workers=workers,
+        log_level='WARNING',
+    )
+    ingest = Ingest('1000:bench', settings)
+    await ingest.start()
+    run = asyncio.create_task(ingest.run())
+
+    # every worker calls getMe once it is up
+    while standins.telegram.calls['getMe'] < workers + 1:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(1)
+
+    answered_mix = [(share, text) for share, text, replied in MIX if replied]
+    for n in range(messages):
+        text = random.choices([text for _, text in answered_mix], [share for share, _ in answered_mix])[0]
+        standins.push(text_update(-1_000_000 - random.randrange(chats), n + 1, text()))
+
+    # wait for every reply, or for no reply to come for a while
+    started = monotonic()
+    answered, last_reply = 0, started
+    while answered < messages and monotonic() - last_reply < 5:
+        await asyncio.sleep(0.01)
+        if len(standins.telegram.sent) != answered:
+            answered, last_reply = len(standins.telegram.sent), monotonic()
+    elapsed = last_reply - started
+
+    run.cancel()
+    await asyncio.gather(run, return_exceptions=True)
+    await ingest.close()
+    standins.stop()
+    data_dir.cleanup()
+    return (answered / elapsed if elapsed else 0), messages - answered
+
+
+def main(chats=200, messages=2000, *workers):
+    logging.getLogger('root').setLevel(logging.WARNING)
+    workers = [int(n) for n in workers] or [1, 2, 4]
+    print(f"{os.cpu_count()} cpus, {chats} chats, {messages} messages")
+    print(f"{'workers':>8}{'replies/s':>12}{'unanswered':>12}")
+    for n in workers:
+        rate, unanswered = asyncio.run(bench(int(chats), int(messages), n))
+        print(f"{n:>8}{rate:>12,.0f}{unanswered:>12}")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
@@ -0,0 +1,91 @@
+"""
+on_next throughput and memory per partition of skip_some, compared with the previous
+dict-of-dicts implementation.
+
+    python -m benchmarks.bench_skip_some [messages]
+"""
+import random
+import sys
+import tracemalloc
+from time import perf_counter, time
+from typing import Any, Callable, Hashable
+
+import reactivex as rx
+from reactivex.subject import Subject
+
+from kover_bot.rx_utils import SkipStats, skip_some
+
+
+def dict_skip_some(min_skip: int, max_skip: int, min_time: float, max_time: float,
+                   partition: Callable[[Any], Hashable], stats: dict):
+    # skip_some as it was before SkipStats, for comparison
+
+    def _skip_some(source):
+        def subscribe(observer, scheduler=None):
+            def _reset_stats(partition_key):
+                if partition_key not in stats:
+                    stats[partition_key] = {}
+
+                stats[partition_key].update({
+                    'skipped': 0,
+                    'last_message': time(),
+                    'to_skip': random.randint(min_skip, max_skip),
+                    'to_wait': random.random() * (max_time - min_time) + min_time,
+                })
+
+            def on_next(value):
+                partition_key = partition(value)
+                if partition_key not in stats:
+                    _reset_stats(partition_key)
+
+                elif (
+                        stats[partition_key]['skipped'] >= stats[partition_key]['to_skip'] and
+                        stats[partition_key]['last_message'] + stats[partition_key]['to_wait']
+                        <= time()
+                ):
+                    observer.on_next(value)
+                    _reset_stats(partition_key)
+                else:
+                    stats[partition_key]['skipped'] += 1
+
+            return source.subscribe(on_next, observer.on_error, observer.on_completed,
+                                    scheduler=scheduler)
+
+        return rx.create(subscribe)
+
+    return _skip_some
+
+
+def run(operator, chats: int, messages: int) -> tuple[float, float]:
+    subject = Subject()
+    subject.pipe(operator).subscribe(lambda _: None)
+    keys = [random.randrange(chats) for _ in range(messages)]
+
+    tracemalloc.start()
+    for chat_id in range(chats):
+        subject.on_next(chat_id)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    started = perf_counter()
+    for chat_id in keys:
+        subject.on_next(chat_id)
+    elapsed = perf_counter() - started
+
+    return messages / elapsed, memory / chats
+
+
+def main(messages=1_000_000):
+    print(f"{'chats':>8}{'impl':>8}{'on_next/s':>14}{'bytes/chat':>12}")
+    for chats in (10_000, 100_000):
+        for name, operator in (
+                ('dict', dict_skip_some(60, 180, 60, 120, partition=lambda v: v, stats={})),
+                ('arrays', skip_some(60, 180, 60, 120, partition=lambda v: v,
+                                     stats=SkipStats(max_partitions=chats))),
+        ):
+            rate, per_chat = run(operator, chats, messages)
+            print(f"{chats:>8}{name:>8}{rate:>14,.0f}{per_chat:>12.0f}")
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
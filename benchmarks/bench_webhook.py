@@ -0,0 +1,142 @@
+"""
+The webhook transport against the local stand-ins: reply latency with updates posted by the
+fake Telegram to the bot's webhook, compared with long polling, and the answers of the webhook
+to requests that are not valid updates.
+
+Malformed bodies must get a 400, which Telegram does not redeliver, and requests without the
+secret token a 403; a 5xx would have Telegram retry the same update over and over.
+
+    python -m benchmarks.bench_webhook [chats] [messages] [rate]
+"""
+import asyncio
+import logging
+import random
+import socket
+import sys
+import tempfile
+from collections import defaultdict, deque
+from statistics import quantiles
+from time import monotonic
+
+import aiohttp
+
+from benchmarks.bench_e2e import MIX
+from benchmarks.standins import Sent, StandIns, text_update
+from kover_bot.bot2 import KoverBot
+from kover_bot.settings import Settings
+from kover_bot.webhook import SECRET_TOKEN_HEADER
+
+SECRET = 'bench-secret'
+
+# bodies a webhook may be sent, and the status it must answer with
+PROBES = [
+    ('not json', b'{', SECRET, 400),
+    ('empty object', b'{}', SECRET, 400),
+    ('list', b'[]', SECRET, 400),
+    ('null', b'null', SECRET, 400),
+    ('bad fields', b'{"update_id": "a", "message": 5}', SECRET, 400),
+    ('no update_id type', b'{"update_id": "a"}', SECRET, 400),
+    ('message without date', b'{"update_id": 1, "message": {"message_id": 1}}', SECRET, 400),
+    ('no secret', b'{"update_id": 1}', '', 403),
+    ('wrong secret', b'{"update_id": 1}', 'guess', 403),
+]
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+async def probe(url: str) -> list[tuple[str, int, int]]:
+    results = []
+    async with aiohttp.ClientSession() as session:
+        for name, body, secret, expected in PROBES:
+            headers = {'Content-Type': 'application/json'}
+            if secret:
+                headers[SECRET_TOKEN_HEADER] = secret
+            async with session.post(url, data=body, headers=headers) as response:
+                results.append((name, response.status, expected))
+    return results
+
+
+async def bench(transport: str, chats: int, messages: int, rate: float):
+    pending: dict[int, deque[float]] = defaultdict(deque)
+    latencies: list[float] = []
+
+    def on_send(sent: Sent):
+        queue = pending.get(sent.chat_id)
+        if queue:
+            latencies.append(sent.at - queue.popleft())
+
+    standins = StandIns(on_send)
+    standins.start()
+
+    data_dir = tempfile.TemporaryDirectory()
+    port = free_port()
+    webhook_url = f'http://127.0.0.1:{port}/telegram' if transport == 'webhook' else ''
+    settings = Settings(
+        data_dir=data_dir.name,
+        svalko_url=standins.svalko_url,
+        baneks_url=standins.baneks_url,
+        telegram_api_url=standins.telegram_url,
+        send_interval=0,
+        send_rate=1_000_000,
+        webhook_url=webhook_url,
+        webhook_secret=SECRET if webhook_url else '',
+        webhook_host='127.0.0.1',
+        webhook_port=port,
+        log_level='ERROR',
+    )
+    bot = await KoverBot.create('1000:bench', settings)
+    run = asyncio.create_task(bot.run())
+    while not standins.telegram.calls['setWebhook' if webhook_url else 'getUpdates']:
+        await asyncio.sleep(0.01)
+
+    probes = await probe(webhook_url) if webhook_url else []
+
+    answered_mix = [(share, text) for share, text, replied in MIX if replied]
+    texts = [text for _, text in answered_mix]
+    shares = [share for share, _ in answered_mix]
+    started = monotonic()
+    for n in range(messages):
+        chat_id = -1_000_000 - random.randrange(chats)
+        pending[chat_id].append(monotonic())
+        standins.push(text_update(chat_id, n + 1, random.choices(texts, shares)[0]()))
+        delay = started + (n + 1) / rate - monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    deadline = monotonic() + 30
+    while len(latencies) < messages and monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+    run.cancel()
+    await asyncio.gather(run, return_exceptions=True)
+    await bot.close()
+    statuses = dict(standins.telegram.webhook_statuses)
+    standins.stop()
+    data_dir.cleanup()
+
+    p50, p99 = 0, 0
+    if len(latencies) > 1:
+        percentiles = quantiles(latencies, n=100)
+        p50, p99 = percentiles[49] * 1000, percentiles[98] * 1000
+    print(f"{transport:>8}{len(latencies):>10}{p50:>10.1f}{p99:>10.1f}  {statuses or ''}")
+    return probes
+
+
+def main(chats=50, messages=500, rate=200):
+    logging.getLogger('root').setLevel(logging.ERROR)
+    print(f"{chats} chats, {messages} messages at {rate} updates/s")
+    print(f"{'':>8}{'answered':>10}{'p50, ms':>10}{'p99, ms':>10}  deliveries")
+    probes = []
+    for transport in ('polling', 'webhook'):
+        probes += asyncio.run(bench(transport, int(chats), int(messages), float(rate)))
+    print()
+    for name, status, expected in probes:
+        print(f"  {name:<24}{status:>5}  {'ok' if status == expected else f'expected {expected}'}")
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
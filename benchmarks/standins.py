@@ -0,0 +1,273 @@
+"""
+Local stand-ins for svalko.org, baneks.ru and the Telegram Bot API, for benchmarking the bot
+without touching the real services. The sites serve the recorded pages in fixtures/, the fake
+Telegram API hands out queued updates through getUpdates, or posts them to the webhook the bot
+set, and records every request the bot makes.
+"""
+import asyncio
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from itertools import count
+from pathlib import Path
+from time import monotonic, time
+from typing import Callable
+
+import aiohttp
+from aiohttp import web
+
+FIXTURES = Path(__file__).parent / 'fixtures'
+
+# not a decodable picture, the bot only relays the bytes
+JPEG = b'\xff\xd8\xff\xe0' + bytes(16 * 1024) + b'\xff\xd9'
+
+
+def _fixture(name: str, base_url: str | None = None) -> bytes:
+    html = (FIXTURES / name).read_text(encoding='utf-8')
+    if base_url:
+        html = html.replace('https://svalko.org', base_url)
+    return html.encode('utf-8')
+
+
+def create_svalko_app(delay: float = 0) -> web.Application:
+    """
+    svalko.org serving the fixtures, with absolute image links pointed back at the stand-in.
+    Every response is held back by delay seconds to stand in for network latency.
+    """
+    pages: dict[tuple[str, str], bytes] = {}
+
+    def html(name: str):
+        async def handler(request: web.Request):
+            key = (name, request.host)
+            if key not in pages:
+                pages[key] = _fixture(name, f'http://{request.host}')
+            await asyncio.sleep(delay)
+            return web.Response(body=pages[key], content_type='text/html', charset='utf-8')
+        return handler
+
+    async def image(request: web.Request):
+        await asyncio.sleep(delay)
+        return web.Response(body=JPEG, content_type='image/jpeg')
+
+    app = web.Application()
+    app.router.add_get('/random.html', html('random.html'))
+    app.router.add_get('/tags.html', html('tags.html'))
+    app.router.add_get('/tag/{tag_id}', html('tag.html'))
+    app.router.add_get('/page/{page}', html('page.html'))
+    app.router.add_get('/images.html', html('images.html'))
+    app.router.add_get('/data/{name}', image)
+    return app
+
+
+def create_baneks_app(delay: float = 0) -> web.Application:
+    page = _fixture('anek.html')
+
+    async def random_anek(request: web.Request):
+        await asyncio.sleep(delay)
+        return web.Response(body=page, content_type='text/html', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/random', random_anek)
+    return app
+
+
+@dataclass(slots=True)
+class Sent:
+    method: str
+    chat_id: int
+    at: float
+
+
+class FakeTelegram:
+    """
+    Just enough of the Bot API for the bot to run against: updates queued with push() are
+    returned by getUpdates, or posted to the webhook once the bot set one, with the status of
+    every post counted in webhook_statuses. Every send is recorded in sent and passed to on_send.
+    """
+    bot_id = 1000
+
+    def __init__(self, on_send: Callable[[Sent], None] | None = None):
+        self.sent: list[Sent] = []
+        self.calls: Counter[str] = Counter()
+        self._on_send = on_send
+        self._updates: list[dict] = []
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        self._file_ids = count(1)
+        self._arrived = asyncio.Event()
+        self.webhook_url = ''
+        self._webhook_secret = ''
+        self.webhook_statuses: Counter[int] = Counter()
+        self._session: aiohttp.ClientSession | None = None
+        self._deliveries: set[asyncio.Task] = set()
+
+    def push(self, update: dict) -> int:
+        """Queue an update, or post it to the webhook if one is set; the update_id is assigned here."""
+        update['update_id'] = next(self._update_ids)
+        if self.webhook_url:
+            task = asyncio.create_task(self._deliver(update))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+        else:
+            self._updates.append(update)
+            self._arrived.set()
+        return update['update_id']
+
+    async def _deliver(self, update: dict):
+        # Telegram does not wait for long, and redelivers on errors; the fake only counts them
+        try:
+            async with self._session.post(self.webhook_url, json=update, headers={
+                'X-Telegram-Bot-Api-Secret-Token': self._webhook_secret,
+            }, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                self.webhook_statuses[response.status] += 1
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            self.webhook_statuses[0] += 1
+
+    async def close(self):
+        for task in self._deliveries:
+            task.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+        if self._session:
+            await self._session.close()
+
+    def pending(self) -> int:
+        return len(self._updates)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/{token}/{method}', self._handle)
+        return app
+
+    async def _handle(self, request: web.Request):
+        params = dict(await request.post())
+        method = request.match_info['method']
+        self.calls[method] += 1
+        handler = getattr(self, f'_{method}', None)
+        if handler is None:
+            return web.json_response({'ok': False, 'error_code': 404, 'description': 'Not Found'},
+                                     status=404)
+        return web.json_response({'ok': True, 'result': await handler(params)})
+
+    def _record(self, method: str, chat_id: int):
+        sent = Sent(method, chat_id, monotonic())
+        self.sent.append(sent)
+        if self._on_send:
+            self._on_send(sent)
+
+    def _message(self, chat_id: int, **fields) -> dict:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time()),
+            'chat': {'id': chat_id, 'type': 'supergroup'},
+            'from': {'id': self.bot_id, 'is_bot': True, 'first_name': 'kover_bot'},
+            **fields,
+        }
+
+    async def _getMe(self, params):
+        return {'id': self.bot_id, 'is_bot': True, 'first_name': 'kover_bot', 'username': 'kover_bot'}
+
+    async def _setWebhook(self, params):
+        self.webhook_url = params['url']
+        self._webhook_secret = params.get('secret_token', '')
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        return True
+
+    async def _deleteWebhook(self, params):
+        self.webhook_url = ''
+        return True
+
+    async def _getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+        # confirmed updates are dropped, like Telegram does
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.pop(0)
+        if not self._updates and timeout:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def _sendChatAction(self, params):
+        return True
+
+    async def _sendMessage(self, params):
+        chat_id = int(params['chat_id'])
+        self._record('sendMessage', chat_id)
+        return self._message(chat_id, text=params.get('text', ''))
+
+    async def _sendPhoto(self, params):
+        chat_id = int(params['chat_id'])
+        self._record('sendPhoto', chat_id)
+        n = next(self._file_ids)
+        return self._message(chat_id, photo=[{
+            'file_id': f'photo{n}', 'file_unique_id': f'unique{n}', 'width': 800, 'height': 600,
+        }], caption=params.get('caption'))
+
+
+def text_update(chat_id: int, message_id: int, text: str, user_id: int = 1) -> dict:
+    """A group text message, with the bot_command entity Telegram adds for /commands."""
+    message = {
+        'message_id': message_id,
+        'date': int(time()),
+        'chat': {'id': chat_id, 'type': 'supergroup', 'username': f'chat{chat_id}'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+        'text': text,
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': message}
+
+
+async def serve(app: web.Application, host: str = '127.0.0.1') -> tuple[web.AppRunner, str]:
+    """Start app on a free port, returns the runner to clean up and the base url."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{port}'
+
+
+class StandIns:
+    """The stand-in servers, running on their own loop in a background thread."""
+
+    def __init__(self, on_send):
+        self.loop = asyncio.new_event_loop()
+        self.telegram: FakeTelegram | None = None
+        self._on_send = on_send
+        self._ready = threading.Event()
+        self._stopped: asyncio.Event | None = None
+        self._thread = threading.Thread(target=self.loop.run_until_complete, args=(self._run(),),
+                                        daemon=True)
+
+    async def _run(self):
+        self.telegram = FakeTelegram(self._on_send)
+        self._stopped = asyncio.Event()
+        runners = []
+        for name, app in (('telegram', self.telegram.create_app()),
+                          ('svalko', create_svalko_app()),
+                          ('baneks', create_baneks_app())):
+            runner, url = await serve(app)
+            runners.append(runner)
+            setattr(self, f'{name}_url', url)
+        self._ready.set()
+        await self._stopped.wait()
+        await self.telegram.close()
+        for runner in runners:
+            await runner.cleanup()
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait()
+
+    def push(self, update: dict):
+        self.loop.call_soon_threadsafe(self.telegram.push, update)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join()
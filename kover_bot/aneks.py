@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import aiohttp
+
+from kover_bot.http import CircuitOpen
+
+logger = logging.getLogger('root')
+
+
+class _Recent:
+    """Ring of hashes of the aneks recently served to one chat."""
+    __slots__ = ('hashes', 'position')
+
+    def __init__(self, size: int):
+        self.hashes = array('q', bytes(8 * size))
+        self.position = 0
+
+    def __contains__(self, h: int) -> bool:
+        return h in self.hashes
+
+    def add(self, h: int):
+        self.hashes[self.position] = h
+        self.position = (self.position + 1) % len(self.hashes)
+
+
+class AnekCorpus:
+    """
+    Aneks collected from baneks.ru, kept in memory and appended to a file on disk.
+    Replies are drawn from the corpus right away while a background task keeps fetching
+    new aneks into it, until it holds max_size of them. Every chat remembers hashes of the
+    aneks it got recently in a fixed-size ring, and is not served those again: when the
+    corpus has no others for the chat, a new anek is fetched for it.
+    """
+
+    def __init__(self, path: str, fetch: Callable[[], Awaitable[str | None]],
+                 refresh_interval: float = 30, warmup_interval: float = 2, warm_size: int = 200,
+                 max_size: int = 50_000, recent_size: int = 128, max_chats: int = 10_000):
+        self._path = path
+        self._fetch = fetch
+        self._refresh_interval = refresh_interval
+        self._warmup_interval = warmup_interval
+        self._warm_size = warm_size
+        self._max_size = max_size
+        self._recent_size = recent_size
+        self._max_chats = max_chats
+        self._aneks: list[str] = []
+        self._hashes: set[int] = set()
+        self._recent: OrderedDict[int, _Recent] = OrderedDict()
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        self._task: asyncio.Task | None = None
+
+    def __len__(self):
+        return len(self._aneks)
+
+    def _load(self) -> list[str]:
+        if not os.path.exists(self._path):
+            return []
+        with open(self._path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    async def open(self):
+        for anek in await asyncio.to_thread(self._load):
+            self._add(anek)
+        logger.info(f"anek corpus loaded, {len(self._aneks)} aneks")
+
+    def start(self):
+        self._task = asyncio.create_task(self._refresh())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _add(self, anek: str) -> bool:
+        h = hash(anek)
+        if h in self._hashes or len(self._aneks) >= self._max_size:
+            return False
+        self._hashes.add(h)
+        self._aneks.append(anek)
+        return True
+
+    def add(self, anek: str):
+        anek = anek.strip()
+        if anek and self._add(anek):
+            task = asyncio.create_task(self._save(anek))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _append(self, anek: str):
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        with open(self._path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(anek, ensure_ascii=False) + '\n')
+
+    async def _save(self, anek: str):
+        async with self._lock:
+            try:
+                await asyncio.to_thread(self._append, anek)
+            except OSError:
+                logger.exception("Error when saving anek corpus")
+
+    async def fetch(self) -> str | None:
+        try:
+            anek = await self._fetch()
+        except CircuitOpen:
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            logger.exception("Error when fetching anek")
+            return None
+        if anek:
+            self.add(anek)
+        return anek
+
+    def _unseen(self, recent: _Recent | None) -> str | None:
+        # the ring holds at most recent_size aneks, so scanning on from a random one finds an
+        # unseen anek within recent_size + 1 steps, if the corpus has any
+        if not self._aneks:
+            return None
+        start = random.randrange(len(self._aneks))
+        for i in range(min(len(self._aneks), self._recent_size + 1)):
+            anek = self._aneks[(start + i) % len(self._aneks)]
+            if recent is None or hash(anek) not in recent:
+                return anek
+        return None
+
+    async def get(self, chat_id: int) -> str | None:
+        """
+        A random anek the chat has not seen recently. When the chat has seen every anek in the
+        corpus, as it does while the corpus is still small, a new one is fetched from upstream,
+        and only if that fails it gets one it has seen.
+        """
+        recent = self._recent.get(chat_id)
+        anek = self._unseen(recent)
+        if anek is None:
+            anek = await self.fetch()
+            anek = anek.strip() if anek else None
+            if not anek:
+                if not self._aneks:
+                    return None
+                anek = random.choice(self._aneks)
+
+        recent = self._recent.pop(chat_id, None) or _Recent(self._recent_size)
+        recent.add(hash(anek))
+        self._recent[chat_id] = recent
+        if len(self._recent) > self._max_chats:
+            self._recent.popitem(last=False)
+        return anek
+
+    async def _refresh(self):
+        # a full corpus takes no more aneks, fetching more would only load upstream
+        while len(self._aneks) < self._max_size:
+            try:
+                await self.fetch()
+            except Exception:
+                logger.exception("Unexpected error when refreshing anek corpus")
+            await asyncio.sleep(
+                self._warmup_interval if len(self._aneks) < self._warm_size else self._refresh_interval
+            )
@@ -0,0 +1,140 @@
+import asyncio
+import heapq
+import logging
+import math
+from dataclasses import dataclass
+from io import BytesIO
+from itertools import count
+from time import time
+from typing import Awaitable, Callable, Hashable
+
+logger = logging.getLogger('root')
+
+
+@dataclass(slots=True)
+class Picture:
+    url: str
+    # None when telegram already has the picture under a cached file_id
+    data: BytesIO | None = None
+
+
+@dataclass(slots=True)
+class _Schedule:
+    period: float
+    due: float
+    version: int
+    # prefetch lead, less than the period so a round is fetched after the one before it
+    lead: float
+
+
+class AutoPicScheduler:
+    """
+    One heap of due times for the periodic pictures of every chat, instead of a timer per chat.
+    Due times are aligned to multiples of the period in wall clock time, so an hourly picture
+    comes on the hour and chats with the same period are due at the same moment. The picture
+    is fetched lead seconds, at most half the period, before it is due and sent to every chat
+    due within tolerance of each other, so the send happens on time and a group of chats shares
+    one picture.
+    """
+
+    def __init__(self, prefetch: Callable[[], Awaitable[Picture | None]],
+                 send: Callable[[list[Hashable], Picture], Awaitable[None]],
+                 lead: float = 30, tolerance: float = 1):
+        self._prefetch = prefetch
+        self._send = send
+        self._lead = lead
+        self._tolerance = tolerance
+        self._schedules: dict[Hashable, _Schedule] = {}
+        # (due, seq, chat_id, version), entries of changed schedules are skipped when popped
+        self._heap: list[tuple[float, int, Hashable, int]] = []
+        self._seq = count()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._firing: set[asyncio.Task] = set()
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def set_period(self, chat_id: Hashable, period: float | None):
+        """Send a picture to the chat every period seconds, or stop if period is None."""
+        old = self._schedules.pop(chat_id, None)
+        if not period:
+            return
+        loop_time = asyncio.get_running_loop().time()
+        wall = time()
+        due = loop_time + (wall // period + 1) * period - wall
+        schedule = self._schedules[chat_id] = _Schedule(period, due, old.version + 1 if old else 0,
+                                                        min(self._lead, period / 2))
+        heapq.heappush(self._heap, (due, next(self._seq), chat_id, schedule.version))
+        self._wakeup.set()
+
+    def _valid(self, entry: tuple[float, int, Hashable, int]) -> bool:
+        schedule = self._schedules.get(entry[2])
+        return schedule is not None and schedule.version == entry[3] and schedule.due == entry[0]
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        for task in self._firing:
+            task.cancel()
+        if self._firing:
+            await asyncio.gather(*self._firing, return_exceptions=True)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            while self._heap and not self._valid(self._heap[0]):
+                heapq.heappop(self._heap)
+
+            now = loop.time()
+            timeout = None
+            if self._heap:
+                due, _, chat_id, _ = self._heap[0]
+                timeout = due - self._schedules[chat_id].lead - now
+            if timeout is None or timeout > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            group = []
+            while self._heap and self._heap[0][0] <= due + self._tolerance:
+                entry = heapq.heappop(self._heap)
+                if self._valid(entry):
+                    group.append(entry[2])
+            # rescheduled after the group is taken, so a period shorter than tolerance cannot repeat it
+            for chat_id in group:
+                schedule = self._schedules[chat_id]
+                # after a long stall skip the missed pictures rather than sending them all at once
+                schedule.due += schedule.period * max(1, math.ceil((now - schedule.due) / schedule.period))
+                heapq.heappush(self._heap, (schedule.due, next(self._seq), chat_id, schedule.version))
+
+            task = asyncio.create_task(self._fire(due, group))
+            self._firing.add(task)
+            task.add_done_callback(self._firing.discard)
+
+    async def _fire(self, due: float, chat_ids: list[Hashable]):
+        try:
+            picture = await self._prefetch()
+        except Exception:
+            logger.exception("Error when prefetching auto pic")
+            return
+        if picture is None:
+            logger.warning(f"no auto pic for {len(chat_ids)} chats")
+            return
+
+        await asyncio.sleep(due - asyncio.get_running_loop().time())
+        logger.info(f"sending auto pic {picture.url} to {len(chat_ids)} chats")
+        try:
+            await self._send(chat_ids, picture)
+        except Exception:
+            logger.exception("Error when sending auto pic")
@@ -1,30 +1,50 @@
 import asyncio
 import logging
+import multiprocessing
+import os
 import random
-import re
 import sys
-from asyncio import sleep
 from contextlib import contextmanager
-from dataclasses import dataclass, field
 from functools import partial
 from io import BytesIO
+from queue import Empty
+from typing import Callable, TypeVar
+from urllib.parse import urlsplit
 
 import aiohttp
-import reactivex as rx
 import reactivex.operators as op
 import telegram
-from bs4 import BeautifulSoup
-from reactivex import Observable
-from reactivex.disposable import CompositeDisposable
+from aiohttp import web
 from reactivex.scheduler.eventloop import AsyncIOThreadSafeScheduler
-from reactivex.subject import Subject, BehaviorSubject
-from telegram import MessageEntity
-from telegram.error import NetworkError, RetryAfter, TimedOut
-
-from kover_bot.rx_utils import skip_some
+from reactivex.subject import Subject
+from telegram import ChatMember
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError, TimedOut
+
+from kover_bot import scrapers
+from kover_bot.aneks import AnekCorpus
+from kover_bot.autopics import AutoPicScheduler, Picture
+from kover_bot.chats import Chat, ChatRegistry
+from kover_bot.dispatch import NativeDispatcher
+from kover_bot.file_ids import FileIdCache
+from kover_bot.http import CircuitBreaker, Hedger, SingleFlight, create_session
+from kover_bot.kaments import KamentBuffer
+from kover_bot.limiter import HandlerLimiter
+from kover_bot.metrics import Metrics
+from kover_bot.outbound import Priority, SendScheduler
+from kover_bot.parsing import ParserPool
+from kover_bot.relay import ImageRejected, read_image
+from kover_bot.router import TriggerRouter
+from kover_bot.rx_utils import SkipStats, skip_some
+from kover_bot.scrapers import Post, Tag
+from kover_bot.settings import Settings
+from kover_bot.state import ChatState, State, StateStore
+from kover_bot.tags import TagIndex, TagPostCache
+from kover_bot.webhook import create_webhook_app
 
 UPDATE_ID = None
 
+T = TypeVar('T')
+
 logger = logging.getLogger('root')
 logger.setLevel(logging.INFO)
 
@@ -36,351 +56,663 @@ logging.basicConfig(
 )
 
 
+async def poll_updates(bot: telegram.Bot, offset: int | None, limit: int = 100):
+    """Long poll getUpdates from offset on, yielding every non-empty batch."""
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, limit=limit, timeout=10)
+            if updates:
+                logger.debug(f"got {len(updates)} updates, last {updates[-1].update_id}")
+                offset = updates[-1].update_id + 1
+                yield updates
+        except NetworkError:
+            logger.exception("Error when calling bot.get_updates")
+            await asyncio.sleep(10)
+        except RetryAfter as e:
+            logger.exception("RetryAfter when calling bot.get_updates")
+            await asyncio.sleep(e.retry_after + 1)
+
+
 @contextmanager
 def handle_telegram_error():
     try:
         yield
-    except TimedOut:
+    except (TimedOut, RetryAfter):
         logger.exception("Telegram error")
 
 
-@dataclass
-class Chat:
-    chat_id: int
-    username: str
-    disposable: CompositeDisposable = field(default_factory=CompositeDisposable)
-    svalko_pic_period: Subject = field(default_factory=partial(BehaviorSubject, value=None))
-
-
 class KoverBot:
-    kovrobot_re = re.compile(r'^.*ковробот.*$', re.IGNORECASE)
-    ptaag_re = re.compile(r'\B(\#\w+\b)(?!;.)')
-    svalko_re = re.compile(r"^javascript: image_view\(\'svalko\.org\', \'(.*?)\', \d+, \d+\);$")
-    anek_re = re.compile(r'^.*анекдот.*$', re.IGNORECASE)
-    privet_re = re.compile(r'^о привет$', re.IGNORECASE)
-
-    chats = BehaviorSubject({})
-    updates = Subject()
+    # text triggers, checked in a single pass by TriggerRouter
+    triggers = {
+        'kovrobot': r'ковробот',
+        'ptaag': r'^(?=\#(?P<tag>\w+)\b(?!;.))',
+        'anek': r'анекдот',
+        'privet': r'^(?=о привет$)',
+    }
+
+    # skip_some arguments of the random replies
+    random_reply_skip = (60, 180, 60, 120)
+    # seconds of quiet before answering o privet
+    privet_debounce = 20
+
+    svalkopic_tries = 5
+
+    chats: ChatRegistry
+    updates: Subject
+    dispatcher: NativeDispatcher | None = None
     update_id: int | None
+    skip_stats: SkipStats
     bot: telegram.Bot
+    settings: Settings
+    metrics: Metrics
+    session: aiohttp.ClientSession
+    inflight: SingleFlight
+    hedger: Hedger
+    breakers: dict[str, CircuitBreaker]
+    image_names: list[str]
+    parser: ParserPool
+    outbound: SendScheduler
+    handlers: HandlerLimiter
+    autopics: AutoPicScheduler
+    kaments: KamentBuffer
+    tags: TagIndex
+    tag_posts: TagPostCache
+    file_ids: FileIdCache
+    aneks: AnekCorpus
+    state: StateStore
 
     @classmethod
-    async def create(cls, token: str):
+    async def create(cls, token: str, settings: Settings | None = None):
         self = cls()
+        self.settings = settings or Settings()
+        self.updates = Subject()
+        logger.setLevel(self.settings.log_level)
 
         logger.info("Starting...")
 
-        self.bot = telegram.Bot(token)
+        self.bot = telegram.Bot(token,
+                                base_url=f"{self.settings.telegram_api_url}/bot",
+                                base_file_url=f"{self.settings.telegram_api_url}/file/bot")
         await self.bot.initialize()
-
-        self.update_id = None
+        self.metrics = Metrics(enabled=bool(self.settings.metrics_port))
+        self.session = create_session([self.metrics.trace_config()] if self.metrics.enabled else ())
+        self.inflight = SingleFlight()
+        self.hedger = Hedger({
+            urlsplit(self.settings.svalko_url).hostname: self.settings.svalko_timeout,
+            urlsplit(self.settings.baneks_url).hostname: self.settings.baneks_timeout,
+        }, quantile=self.settings.hedge_quantile, max_hedge_ratio=self.settings.hedge_ratio)
+        self.breakers = {}
+        self.image_names = []
+        self.parser = ParserPool(self.settings.parser_workers, self.settings.parser_processes)
+        self.kaments = KamentBuffer(self.fetch_kaments)
+        self.kaments.start()
+        self.tags = TagIndex(self.fetch_tags)
+        self.tags.start()
+        self.tag_posts = TagPostCache(self.fetch_tag_pages, self.fetch_tag_posts)
+        self.file_ids = FileIdCache(os.path.join(self.settings.data_dir, 'file_ids.sqlite3'))
+        await self.file_ids.open()
+        self.aneks = AnekCorpus(os.path.join(self.settings.data_dir, 'aneks.jsonl'), self.fetch_anek,
+                                self.settings.anek_refresh_interval)
+        await self.aneks.open()
+        self.aneks.start()
+
+        self.state = StateStore(os.path.join(self.settings.data_dir, 'state.sqlite3'),
+                                self.settings.state_interval)
+        state = await self.state.load()
+        self.update_id = state.update_id
+        self.skip_stats = SkipStats(self.settings.skip_partitions)
+        self.skip_stats.load(state.skip_stats)
+        self.chats = ChatRegistry()
+        for chat_state in state.chats:
+            # the ingest moves chats to their worker on start, in case one is left over anyway
+            if self.settings.worker_index >= 0 and \
+                    chat_state.chat_id % self.settings.workers != self.settings.worker_index:
+                logger.info(f"dropping chat {chat_state.chat_id} of another worker")
+                continue
+            chat = self.chats.add(Chat(chat_state.chat_id, chat_state.username))
+            if chat_state.svalko_pic_period:
+                chat.svalko_pic_period.on_next(chat_state.svalko_pic_period)
+        self.state.start(self.snapshot_state)
+
+        self.outbound = SendScheduler(self.settings.send_interval, self.settings.send_rate,
+                                      self.settings.send_retries)
+        self.outbound.start()
+        self.handlers = HandlerLimiter(self.settings.handler_tasks, self.settings.handler_tasks_per_chat,
+                                       self.settings.handler_backlog, self.settings.handler_backlog_per_chat)
+        self.autopics = AutoPicScheduler(self.prefetch_auto_pic, self.send_auto_pic,
+                                         self.settings.auto_pic_lead)
+        self.autopics.start()
+
+        self._instrument()
+        if self.metrics.enabled:
+            await self.metrics.start(self.settings.metrics_host, self.settings.metrics_port)
         return self
 
-    def command_obs(self, command: str) -> Observable:
-        return self.updates.pipe(
-            op.filter(lambda update: update.effective_message),
-            op.map(lambda update: update.effective_message),
-            op.filter(lambda message: (
-                    message.entities
-                    and message.entities[0].type == MessageEntity.BOT_COMMAND
-                    and message.entities[0].offset == 0
-                    and message.text
-                    and message.text[1: message.entities[0].length].split('@')[0].lower()
-                    == command
-            )),
-            op.share(),
+    async def close(self):
+        logger.info("Shutting down...")
+        await self.metrics.close()
+        if self.dispatcher:
+            self.dispatcher.close()
+        await self.handlers.close()
+        await self.autopics.close()
+        await self.kaments.close()
+        await self.tags.close()
+        await self.aneks.close()
+        await self.outbound.close()
+        await self.state.close()
+        await self.file_ids.close()
+        await self.session.close()
+        self.parser.close()
+        await self.bot.shutdown()
+
+    def _instrument(self):
+        for name in ('get_kament', 'handle_reply', 'handle_kament', 'handle_anek', 'handle_svalkopic',
+                     'send_reply', 'send_message', 'send_photo', 'send_chat_action', 'send_svalko_photo'):
+            setattr(self, name, self.metrics.timed(getattr(self, name)))
+
+        metrics = self.metrics
+        metrics.counter('kover_updates_total', 'Telegram updates received')
+        metrics.gauge('kover_chats', 'Chats the bot is in', lambda: len(self.chats))
+        metrics.gauge('kover_outbound_queue', 'Sends waiting in the outbound queue', self.outbound.qsize)
+        metrics.gauge('kover_upstream_hedge_delay_seconds', 'Latency after which requests are hedged',
+                      lambda: {(host,): self.hedger.hedge_delay(host) or 0 for host in self.hedger.hosts},
+                      ('host',))
+        metrics.counter('kover_upstream_hedged_total', 'Hedged upstream requests', ('host',),
+                        lambda: {(host,): latency.hedged for host, latency in self.hedger.hosts.items()})
+        metrics.counter('kover_upstream_hedge_wins_total', 'Hedged requests answered first', ('host',),
+                        lambda: {(host,): latency.hedge_wins for host, latency in self.hedger.hosts.items()})
+        metrics.gauge('kover_circuit_open', 'Whether requests to the host fail fast', lambda: {
+            (host,): int(breaker.state == CircuitBreaker.OPEN) for host, breaker in self.breakers.items()
+        }, ('host',))
+        metrics.counter('kover_circuit_transitions_total', 'Circuit breaker state changes', ('host', 'state'),
+                        lambda: {(host, state): count for host, breaker in self.breakers.items()
+                                 for state, count in breaker.transitions.items()})
+        metrics.gauge('kover_auto_pic_chats', 'Chats with periodic pictures', lambda: len(self.autopics))
+        metrics.gauge('kover_handlers_running', 'Handler tasks running', self.handlers.running)
+        metrics.gauge('kover_handlers_backlog', 'Handler work waiting to run', self.handlers.backlog)
+        metrics.counter('kover_handlers_dropped_total', 'Handler work dropped when saturated', (),
+                        lambda: {(): self.handlers.dropped})
+        metrics.counter('kover_handlers_coalesced_total', 'Background work coalesced into waiting work', (),
+                        lambda: {(): self.handlers.coalesced})
+        metrics.gauge('kover_kament_buffer', 'Kaments buffered', self.kaments.qsize)
+        metrics.counter('kover_parse_total', 'Pages parsed', ('scraper',), lambda: {
+            (name,): stats.count for name, stats in self.parser.stats.items()
+        })
+        metrics.counter('kover_parse_seconds_total', 'Time spent parsing', ('scraper',), lambda: {
+            (name,): stats.run_total for name, stats in self.parser.stats.items()
+        })
+        metrics.counter('kover_parse_wait_seconds_total', 'Time waited for a parser', ('scraper',), lambda: {
+            (name,): stats.wait_total for name, stats in self.parser.stats.items()
+        })
+
+    def snapshot_state(self) -> State:
+        skip_stats, skip_removed = self.skip_stats.drain_changes()
+        return State(
+            update_id=self.update_id,
+            chats=[
+                ChatState(chat.chat_id, chat.username, chat.svalko_pic_period.value)
+                for chat in self.chats
+            ],
+            skip_stats=skip_stats,
+            skip_removed=skip_removed,
         )
 
     async def _setup(self):
-        scheduler = AsyncIOThreadSafeScheduler(asyncio.get_running_loop())
-
         def _setup_chat(chat: Chat):
-            auto_svalko_pic = chat.svalko_pic_period.pipe(
-                op.map(lambda period: (
-                    rx.never()
-                    if not period else
-                    rx.timer(period, period,
-                             scheduler=scheduler)
-                )),
-                op.switch_latest(),
-                op.flat_map(
-                    lambda message: asyncio.create_task(self.handle_svalkopic(
-                        None, chat.chat_id, None
-                    ))
-                ),
-            ).subscribe(
-                on_next=lambda _: None,
-                scheduler=scheduler
-            )
-            chat.disposable.add(auto_svalko_pic)
+            chat.disposable.add(chat.svalko_pic_period.subscribe(
+                on_next=partial(self.autopics.set_period, chat.chat_id)
+            ))
 
-        self.chats.pipe(
-            op.flat_map(lambda chats: chats.values()),
-            op.filter(lambda chat: not chat.disposable.disposable),
-            op.do_action(on_next=logger.info)
-        ).subscribe(on_next=_setup_chat)
+        for chat in self.chats:
+            _setup_chat(chat)
+        self.chats.added.subscribe(on_next=_setup_chat)
+        self.chats.removed.subscribe(on_next=lambda chat: self.autopics.set_period(chat.chat_id, None))
+
+        if self.settings.dispatcher == 'native':
+            self.dispatcher = NativeDispatcher(self)
+        else:
+            self._setup_rx()
+
+    def create_router(self) -> TriggerRouter:
+        router = TriggerRouter(self.triggers)
+        router.add_check('kovrobot', lambda message: bool(
+            message.reply_to_message and
+            message.reply_to_message.from_user and
+            message.reply_to_message.from_user.id == self.bot.id
+        ))
+        return router
+
+    def _setup_rx(self):
+        scheduler = AsyncIOThreadSafeScheduler(asyncio.get_running_loop())
 
         self.updates.pipe(
-            op.with_latest_from(self.chats),
-            op.filter(lambda update_and_chats: (
-                    update_and_chats[0]
-                    and update_and_chats[0].message
-                    and update_and_chats[0].message.chat.id
-                    and update_and_chats[0].message.chat.type in ('group', 'supergroup')
-                    and update_and_chats[0].message.chat.id not in update_and_chats[1]
-            ))
+            op.filter(self.is_new_chat)
         ).subscribe(
-            on_next=lambda update_and_chats: self.handle_new_chat(
-                chats=update_and_chats[1],
-                chat_id=update_and_chats[0].message.chat.id,
-                username=update_and_chats[0].message.chat.username)
+            on_next=lambda update: self.handle_new_chat(
+                chat_id=update.message.chat.id,
+                username=update.message.chat.username)
         )
 
+        # forget chats the bot was kicked from or left
+        self.updates.pipe(
+            op.filter(self.is_chat_left)
+        ).subscribe(
+            on_next=lambda update: self.chats.remove(update.my_chat_member.chat.id)
+        )
+
+        router = self.create_router()
+
+        self.updates.pipe(
+            op.filter(lambda update: bool(update.effective_message)),
+        ).subscribe(on_next=lambda update: router.route_command(update.effective_message))
+
         messages = self.updates.pipe(
             op.filter(lambda update: bool(update.message and update.message.text)),
             op.share()
         )
-
-        async def get_response(update):
-            return update, await self.get_kament()
+        messages.subscribe(on_next=lambda update: router.route_text(update.message))
 
         # random response
         messages.pipe(
-            skip_some(60, 180, 60, 120, partition=lambda update: update.message.chat.id),
-            op.flat_map(lambda update: asyncio.create_task(get_response(update))),
-            op.filter(lambda args: args[1]),
-            op.flat_map(lambda args: asyncio.create_task(self.send_reply(args[0].message, args[1]))),
+            skip_some(*self.random_reply_skip, partition=lambda update: update.message.chat.id,
+                      stats=self.skip_stats),
         ).subscribe(
-            on_next=lambda _: None,
+            on_next=lambda update: self.on_random_reply(update.message),
             scheduler=scheduler
         )
 
         # respond to me or to replies on my posts
-        messages.pipe(
-            op.filter(lambda update: bool(
-                self.kovrobot_re.match(update.message.text) or
-                (
-                        update.message.reply_to_message and
-                        update.message.reply_to_message.from_user.id == self.bot.id
-                )
-            )),
-            op.flat_map(lambda update: asyncio.create_task(get_response(update))),
-            op.filter(lambda args: args[1]),
-            op.flat_map(lambda args: asyncio.create_task(self.send_reply(args[0].message, args[1]))),
-        ).subscribe(
-            on_next=lambda _: None,
+        router.trigger('kovrobot').subscribe(
+            on_next=lambda routed: self.on_kovrobot(*routed),
             scheduler=scheduler
         )
 
         # respond to #ptaag picture
-        messages.pipe(
-            op.filter(lambda update: bool(self.ptaag_re.match(update.message.text))),
-            op.flat_map(lambda update: asyncio.create_task(self.handle_svalkopic(
-                self.ptaag_re.findall(update.message.text or '')[0].strip('#'),
-                update.message.chat_id, update.message.message_id, True
-            ))),
-        ).subscribe(
-            on_next=lambda _: None,
+        router.trigger('ptaag').subscribe(
+            on_next=lambda routed: self.on_ptaag(*routed),
             scheduler=scheduler
         )
 
         # respond to anek
-        messages.pipe(
-            op.filter(lambda update: bool(self.anek_re.match(update.message.text))),
-            op.flat_map(lambda update: asyncio.create_task(self.handle_anek(
-                update.message.chat_id, update.message.message_id
-            ))),
-        ).subscribe(
-            on_next=lambda _: None,
+        router.trigger('anek').subscribe(
+            on_next=lambda routed: self.on_anek(*routed),
             scheduler=scheduler
         )
 
-        # respond to o privet
-        messages.pipe(
-            op.filter(lambda update: bool(self.privet_re.match(update.message.text))),
-            op.debounce(20),
-            op.flat_map(lambda update: asyncio.create_task(self.send_message(
-                chat_id=update.message.chat_id,
-                text="о привет")
-            )),
+        # respond to o privet, once a chat has been quiet about it for a while
+        router.trigger('privet').pipe(
+            op.group_by(lambda routed: routed[0].chat_id),
+            op.flat_map(lambda chat: chat.pipe(op.debounce(self.privet_debounce))),
         ).subscribe(
-            on_next=lambda _: None,
+            on_next=lambda routed: self.on_privet(*routed),
             scheduler=scheduler
         )
 
         # /svalkopic
-        self.command_obs('svalkopic').pipe(
-            op.flat_map(
-                lambda message: asyncio.create_task(self.handle_svalkopic(
-                    ''.join(message.text.split(maxsplit=1)[1:]).lower(),
-                    message.chat_id, message.message_id
-                ))
-            ),
-        ).subscribe(
-            on_next=lambda _: None,
+        router.command('svalkopic').subscribe(
+            on_next=self.on_svalkopic,
             scheduler=scheduler
         )
 
         # /kament
-        self.command_obs('kament').pipe(
-            op.flat_map(
-                lambda message: asyncio.create_task(self.handle_kament(message.chat_id))
-            ),
-            op.retry(3)
-        ).subscribe(
-            on_next=lambda _: None,
+        router.command('kament').subscribe(
+            on_next=self.on_kament,
             scheduler=scheduler
         )
 
-    def handle_new_chat(self, chats: dict, chat_id, username):
+    def is_new_chat(self, update: telegram.Update) -> bool:
+        return bool(
+            update
+            and update.message
+            and update.message.chat.id
+            and update.message.chat.type in ('group', 'supergroup')
+            and update.message.chat.id not in self.chats
+        )
+
+    @staticmethod
+    def is_chat_left(update: telegram.Update) -> bool:
+        return bool(
+            update.my_chat_member
+            and update.my_chat_member.new_chat_member.status in (ChatMember.LEFT, ChatMember.BANNED)
+        )
+
+    # behaviours, started by either engine; the work itself runs in the handler limiter
+
+    def on_random_reply(self, message):
+        self.handlers.spawn(message.chat_id, partial(self.handle_reply, message, Priority.BACKGROUND),
+                            Priority.BACKGROUND, key=('reply', message.chat_id))
+
+    def on_kovrobot(self, message, match=None):
+        self.handlers.spawn(message.chat_id, partial(self.handle_reply, message))
+
+    def on_ptaag(self, message, match):
+        self.handlers.spawn(message.chat_id, partial(
+            self.handle_svalkopic, match.group('tag'), message.chat_id, message.message_id, True
+        ))
+
+    def on_anek(self, message, match=None):
+        self.handlers.spawn(message.chat_id, partial(self.handle_anek, message.chat_id, message.message_id))
+
+    def on_privet(self, message, match=None):
+        self.handlers.spawn(message.chat_id, partial(
+            self.send_message, chat_id=message.chat_id, text="о привет"
+        ))
+
+    def on_svalkopic(self, message):
+        self.handlers.spawn(message.chat_id, partial(
+            self.handle_svalkopic,
+            ''.join(message.text.split(maxsplit=1)[1:]).lower(),
+            message.chat_id, message.message_id
+        ))
+
+    def on_kament(self, message):
+        self.handlers.spawn(message.chat_id, partial(self.handle_kament, message.chat_id))
+
+    def handle_new_chat(self, chat_id, username):
         logger.info(f'handle new chat {chat_id} {username}')
-        chats[chat_id] = Chat(chat_id, username)
+        chat = self.chats.add(Chat(chat_id, username))
         if username == 'svalo4ka':
-            chats[chat_id].svalko_pic_period.on_next(3600)
-        self.chats.on_next(chats)
+            chat.svalko_pic_period.on_next(3600)
 
     async def get_updates_async(self):
-        while True:
-            try:
-                for update in await self.bot.get_updates(offset=self.update_id, timeout=10):
-                    logger.debug(f"got update {update.update_id}")
-                    self.update_id = update.update_id + 1
-                    yield update
-            except NetworkError:
-                logger.exception("Error when calling bot.get_updates")
-                await asyncio.sleep(10)
-            except RetryAfter as e:
-                logger.exception("RetryAfter when calling bot.get_updates")
-                await asyncio.sleep(e.retry_after + 1)
+        async for updates in poll_updates(self.bot, self.update_id, self.settings.updates_limit):
+            self.update_id = updates[-1].update_id + 1
+            yield updates
+
+    def push_update(self, update: telegram.Update):
+        if self.update_id is None or update.update_id >= self.update_id:
+            self.update_id = update.update_id + 1
+        self.metrics.inc('kover_updates_total')
+        if self.dispatcher:
+            self.dispatcher.dispatch(update)
+        else:
+            self.updates.on_next(update)
 
     async def run(self):
         await self._setup()
+        if self.settings.webhook_url:
+            await self.run_webhook()
+        else:
+            await self.run_polling()
+
+    async def run_polling(self):
+        await self.bot.delete_webhook()
         # get the first pending update_id, this is so we can skip over it in case
         # we get an "Unauthorized" exception.
-        async for update in self.get_updates_async():
-            await sleep(0.1)
-            self.updates.on_next(update)
+        async for updates in self.get_updates_async():
+            for update in updates:
+                self.push_update(update)
+            # let the handlers spawned by this batch start before polling again
+            await asyncio.sleep(0)
+
+    async def run_worker(self, queue: multiprocessing.Queue):
+        """Handle the batches of updates an ingest process puts in queue, see kover_bot.sharding."""
+        await self._setup()
+        while True:
+            try:
+                batch = await asyncio.to_thread(queue.get, True, 1)
+            except Empty:
+                continue
+            if batch is None:
+                return
+            for data in batch:
+                self.push_update(telegram.Update.de_json(data, self.bot))
+            await asyncio.sleep(0)
+
+    async def run_webhook(self):
+        app = create_webhook_app(self.bot, self.push_update,
+                                 secret_token=self.settings.webhook_secret,
+                                 path=self.settings.webhook_path)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        try:
+            await web.TCPSite(runner, self.settings.webhook_host, self.settings.webhook_port).start()
+            await self.bot.set_webhook(self.settings.webhook_url,
+                                       secret_token=self.settings.webhook_secret)
+            logger.info(f"Listening for webhook updates on "
+                        f"{self.settings.webhook_host}:{self.settings.webhook_port}")
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    async def scrape(self, url: str, scraper: Callable[[bytes], T], coalesce: bool = True) -> T:
+        """
+        Fetch url and parse it with scraper. Concurrent scrapes of the same url share one fetch
+        and its parsed result, unless coalesce is False, which random endpoints must pass.
+        """
+        if coalesce:
+            return await self.inflight.do((url, scraper), partial(self._scrape, url, scraper))
+        return await self._scrape(url, scraper)
+
+    async def _scrape(self, url: str, scraper: Callable[[bytes], T]) -> T:
+        async def fetch() -> bytes:
+            async with self.session.get(url) as response:
+                if response.status >= 500:
+                    response.raise_for_status()
+                return await response.read()
+
+        host = urlsplit(url).hostname
+        async with self.breaker(host):
+            html = await self.hedger.fetch(host, fetch)
+        return await self.parser.parse(scraper, html)
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(host, self.settings.breaker_failures,
+                                                           self.settings.breaker_reset)
+        return breaker
+
+    async def fetch_kaments(self) -> list[str]:
+        return await self.scrape(f"{self.settings.svalko_url}/random.html", scrapers.parse_kaments,
+                                 coalesce=False)
+
+    async def fetch_tags(self) -> list[Tag]:
+        return await self.scrape(f"{self.settings.svalko_url}/tags.html", scrapers.parse_tags)
+
+    async def fetch_tag_pages(self, tag_id: str) -> int:
+        return await self.scrape(f"{self.settings.svalko_url}/tag/{tag_id}", scrapers.parse_tag_pages)
+
+    async def fetch_tag_posts(self, tag_id: str, page: int) -> list[Post]:
+        return await self.scrape(f"{self.settings.svalko_url}/page/{page}?tag_id={tag_id}",
+                                 scrapers.parse_posts)
+
+    async def fetch_anek(self) -> str | None:
+        return await self.scrape(f"{self.settings.baneks_url}/random", scrapers.parse_anek,
+                                 coalesce=False)
 
     async def get_kament(self) -> str:
-        tries = 0
-        comments = []
-        while len(comments) == 0 and tries < 10:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get("https://svalko.org/random.html") as response:
-                        content = await response.read()
-                        soup = BeautifulSoup(content, "html.parser")
-                        comments = [x for x in soup.find_all('div', {'class': 'comment'}) if
-                                    len(x.text) < 500 and x.text.strip()]
-                        tries += 1
-            except aiohttp.ClientError:
-                await asyncio.sleep(1)
-                tries += 1
-
-        if not comments:
-            return ""
-
-        comment = random.choice(comments).find('div', {'class': 'text'})
-        return comment.text
-
-    async def send_reply(self, message, text):
+        return await self.kaments.get()
+
+    async def send_reply(self, message, text, priority=Priority.DIRECT):
         with handle_telegram_error():
-            await message.reply_text(text)
+            await self.outbound.submit(message.chat_id, partial(message.reply_text, text), priority)
 
-    async def send_message(self, chat_id, text, reply_to_message_id=None):
+    async def send_message(self, chat_id, text, reply_to_message_id=None, priority=Priority.DIRECT):
         with handle_telegram_error():
-            await self.bot.send_message(chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id)
+            await self.outbound.submit(chat_id, partial(
+                self.bot.send_message, chat_id=chat_id, text=text, reply_to_message_id=reply_to_message_id
+            ), priority)
+
+    async def send_photo(self, chat_id, photo, caption=None, priority=Priority.DIRECT):
+        async def send():
+            if hasattr(photo, 'seek'):
+                # rewind the buffer in case this is a resend after RetryAfter
+                photo.seek(0)
+            return await self.bot.send_photo(chat_id=chat_id, photo=photo, caption=caption)
+
+        return await self.outbound.submit(chat_id, send, priority)
+
+    async def send_chat_action(self, chat_id, action, priority=Priority.DIRECT):
+        # chat actions are not messages, they only count against the global limit
+        with handle_telegram_error():
+            await self.outbound.submit(None, partial(
+                self.bot.send_chat_action, chat_id=chat_id, action=action
+            ), priority)
+
+    async def download_svalko_photo(self, url) -> BytesIO | None:
+        host = urlsplit(url).hostname
+        try:
+            async with self.breaker(host), asyncio.timeout(self.hedger.budget(host)):
+                async with self.session.get(url) as response:
+                    if response.status >= 500:
+                        response.raise_for_status()
+                    return await read_image(response)
+        except ImageRejected as e:
+            logger.warning(f"image rejected: {e}")
+            return None
+
+    async def send_svalko_photo(self, chat_id, url, caption=None, priority=Priority.DIRECT,
+                                data: BytesIO | None = None) -> bool:
+        """
+        Send the picture at url, by its cached file_id if telegram has it already, otherwise
+        uploading data or, without data, the picture downloaded from url.
+        False if it was not sent, also when handle_telegram_error swallowed the error.
+        """
+        message = None
+        file_id = self.file_ids.get(url)
+        if file_id:
+            try:
+                with handle_telegram_error():
+                    message = await self.send_photo(chat_id, file_id, caption, priority)
+                return message is not None
+            except BadRequest:
+                logger.warning(f"cached file_id for {url} was rejected, uploading again")
+                self.file_ids.discard(url)
+
+        if data is None:
+            data = await self.download_svalko_photo(url)
+            if data is None:
+                return False
+
+        with handle_telegram_error():
+            message = await self.send_photo(chat_id, data, caption, priority)
+            if message.photo:
+                self.file_ids.put(url, message.photo[-1].file_id)
+        return message is not None
+
+    async def handle_reply(self, message, priority=Priority.DIRECT):
+        kament = await self.get_kament()
+        if kament:
+            await self.send_reply(message, kament, priority)
 
     async def handle_kament(self, chat_id):
         logger.info(f"send_kament, chat_id={chat_id}")
         
-        await self.bot.send_chat_action(chat_id=chat_id, action="typing")
+        await self.send_chat_action(chat_id=chat_id, action="typing")
         
         kament = await self.get_kament()
-        await self.send_message(chat_id=chat_id, text=kament)
+        if kament:
+            await self.send_message(chat_id=chat_id, text=kament)
 
     async def handle_anek(self, chat_id, reply_to_id):
         logger.info(f"send_anek, chat_id={chat_id}, reply_to_id={reply_to_id}")
         
-        await self.bot.send_chat_action(chat_id=chat_id, action="typing")
-        
-        async with aiohttp.ClientSession() as session:
-            async with session.get('http://baneks.ru/random') as response:
-                soup = BeautifulSoup(await response.read(), "html.parser")
-        
-        anek = soup.find('section', {'class': 'anek-view'}).find('p').text
+        await self.send_chat_action(chat_id=chat_id, action="typing")
         
+        anek = await self.aneks.get(chat_id)
+
+        if not anek:
+            logger.warning("no anek to send")
+            return
+
         await self.send_message(chat_id=chat_id,
                                 reply_to_message_id=reply_to_id,
                                 text=anek)
 
-    async def handle_svalkopic(self, tag_query, chat_id, reply_to_id, fail_silent=False):
+    async def handle_svalkopic(self, tag_query, chat_id, reply_to_id, fail_silent=False,
+                               priority=Priority.DIRECT):
         logger.info(f"send_svalkopic, chat_id={chat_id}, reply_to_id={reply_to_id}")
         
-        await self.bot.send_chat_action(chat_id=chat_id, action="upload_photo")
+        await self.send_chat_action(chat_id=chat_id, action="upload_photo", priority=priority)
         
-        async with aiohttp.ClientSession() as session:
-            if tag_query:
-                async with session.get("https://svalko.org/tags.html") as response:
-                    soup = BeautifulSoup(await response.read(), "html.parser")
-
-                tagtag = soup.find(attrs={
-                    'href': re.compile(r'^/tag/.*', re.IGNORECASE)
-                }, text=re.compile(r'{}.*'.format(re.escape(tag_query)), re.IGNORECASE))
-
-                if not tagtag:
-                    if not fail_silent:
-                        await self.send_message(chat_id=chat_id,
-                                                reply_to_message_id=reply_to_id,
-                                                text='Нет такого тага')
+        if tag_query:
+            tag_id = await self.tags.lookup(tag_query)
+
+            if not tag_id:
+                if not fail_silent:
+                    await self.send_message(chat_id=chat_id,
+                                            reply_to_message_id=reply_to_id,
+                                            text='Нет такого тага')
+                return
+
+            for _ in range(self.svalkopic_tries):
+                try:
+                    post = await self.tag_posts.sample(tag_id)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.warning(f"no posts for tag {tag_id}: {e!r}")
+                    break
+                if not post:
+                    break
+
+                if post.image_url:
+                    try:
+                        if await self.send_svalko_photo(chat_id, post.image_url,
+                                                        caption=post.text[:200], priority=priority):
+                            return
+                    except (aiohttp.ClientError, asyncio.TimeoutError):
+                        pass
+                else:
+                    await self.send_message(chat_id=chat_id, text=post.text, priority=priority)
                     return
 
-                tag_id = tagtag.attrs['href'].replace('/tag/', '')
-                async with session.get(f"https://svalko.org{tagtag.attrs['href']}") as response:
-                    soup = BeautifulSoup(await response.read(), "html.parser")
-
-                pages = int(
-                    soup.find('div', attrs={'class': 'paging'}).find('b').text.strip('[]'))
-                success = False
-                while not success:
-                    page = random.randint(0, pages)
-                    async with session.get("https://svalko.org/page/{}?tag_id={}".format(page,
-                                                                                         tag_id)) as response:
-                        soup = BeautifulSoup(await response.read(), "html.parser")
-
-                    post = random.choice([x.find('div', attrs={'class': 'text'}) for x in
-                                          soup.find_all('div', attrs={'class': 'posting'})])
-                    tags = post.find('div', attrs={'class': 'tags'})
-                    tags.decompose()
-                    pictag = post.find('img')
-                    if pictag:
-                        try:
-                            async with session.get(pictag.attrs['src']) as response:
-                                b = BytesIO(await response.read())
-
-                            with handle_telegram_error():
-                                await self.bot.send_photo(chat_id=chat_id, photo=b,
-                                                          caption=post.text[:200])
-                            success = True
-                        except aiohttp.ClientError:
-                            pass
-                    else:
-                        await self.send_message(chat_id=chat_id, text=post.text)
-                        success = True
-
-            else:
-
-                async with session.get(
-                        f"https://svalko.org/images.html?rand={random.randint(0, 100000000)}"
-                ) as response:
-                    soup = BeautifulSoup(await response.read(), "html.parser")
-                pictag = random.choice(soup.find_all("a", {"href": self.svalko_re}))
-                name = self.svalko_re.match(pictag.attrs['href']).group(1)
-
-                async with session.get(
-                        f"https://svalko.org/data/{name}"
-                ) as response:
-                    b = BytesIO(await response.read())
-
-                with handle_telegram_error():
-                    await self.bot.send_photo(chat_id=chat_id, photo=b)
+        else:
+            url = await self.pick_svalko_pic()
+            if url:
+                await self.send_svalko_photo(chat_id, url, priority=priority)
+
+    async def pick_svalko_pic(self) -> str | None:
+        """Url of a random svalko.org picture."""
+        try:
+            names = await self.scrape(
+                f"{self.settings.svalko_url}/images.html?rand={random.randint(0, 100000000)}",
+                scrapers.parse_image_names, coalesce=False
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # fall back to the pictures of the last good page that telegram already has
+            logger.warning(f"svalko.org images are unavailable, using cached ones: {e!r}")
+            names = [name for name in self.image_names if self.file_ids.get(self.image_url(name))]
+        else:
+            if names:
+                self.image_names = names
+
+        if not names:
+            logger.warning("svalko.org returned no images")
+            return None
+        return self.image_url(random.choice(names))
+
+    async def prefetch_auto_pic(self) -> Picture | None:
+        url = await self.pick_svalko_pic()
+        if not url:
+            return None
+        if self.file_ids.get(url):
+            return Picture(url)
+        data = await self.download_svalko_photo(url)
+        return Picture(url, data) if data else None
+
+    async def send_auto_pic(self, chat_ids: list[int], picture: Picture):
+        # The picture is uploaded to one chat after the other until telegram has it under a file_id.
+        # The uploads run here rather than in the handler limiter, so the other chats can wait for the
+        # file_id; that is one request a round. The sends by file_id are background work of the limiter
+        # like every other, dropped while it is saturated and coalesced per chat.
+        for i, chat_id in enumerate(chat_ids):
+            if self.file_ids.get(picture.url):
+                for other in chat_ids[i:]:
+                    self.handlers.spawn(other, partial(self.send_auto_pic_to, other, Picture(picture.url)),
+                                        Priority.BACKGROUND, key=('auto_pic', other))
+                return
+            await self.send_auto_pic_to(chat_id, picture)
+
+    async def send_auto_pic_to(self, chat_id: int, picture: Picture):
+        # a chat the bot was kicked from or that migrated must not cost the other chats their picture
+        if picture.data:
+            picture.data.seek(0)
+        try:
+            if not await self.send_svalko_photo(chat_id, picture.url, priority=Priority.BACKGROUND,
+                                                data=picture.data):
+                logger.warning(f"auto pic to chat {chat_id} was not sent")
+        except TelegramError as e:
+            logger.warning(f"could not send auto pic to chat {chat_id}: {e}")
+
+    def image_url(self, name: str) -> str:
+        return f"{self.settings.svalko_url}/data/{name}"
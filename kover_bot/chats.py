@@ -0,0 +1,59 @@
+import logging
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Iterator
+
+from reactivex.disposable import CompositeDisposable
+from reactivex.subject import BehaviorSubject, Subject
+
+logger = logging.getLogger('root')
+
+
+@dataclass
+class Chat:
+    chat_id: int
+    username: str
+    disposable: CompositeDisposable = field(default_factory=CompositeDisposable)
+    svalko_pic_period: BehaviorSubject = field(default_factory=partial(BehaviorSubject, value=None))
+
+
+class ChatRegistry:
+    """
+    Chats the bot is in, keyed by chat id.
+    Emits every chat once on added when it joins and once on removed when it leaves;
+    a removed chat's subscriptions are disposed.
+    """
+
+    def __init__(self):
+        self._chats: dict[int, Chat] = {}
+        self.added = Subject()
+        self.removed = Subject()
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._chats
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __iter__(self) -> Iterator[Chat]:
+        return iter(list(self._chats.values()))
+
+    def get(self, chat_id: int) -> Chat | None:
+        return self._chats.get(chat_id)
+
+    def add(self, chat: Chat) -> Chat:
+        if chat.chat_id in self._chats:
+            return self._chats[chat.chat_id]
+        self._chats[chat.chat_id] = chat
+        logger.info(f"chat added: {chat.chat_id} {chat.username}")
+        self.added.on_next(chat)
+        return chat
+
+    def remove(self, chat_id: int) -> Chat | None:
+        chat = self._chats.pop(chat_id, None)
+        if chat is None:
+            return None
+        chat.disposable.dispose()
+        logger.info(f"chat removed: {chat.chat_id} {chat.username}")
+        self.removed.on_next(chat)
+        return chat
@@ -0,0 +1,75 @@
+import asyncio
+from typing import TYPE_CHECKING, Callable
+
+import telegram
+
+from kover_bot.router import message_command
+from kover_bot.rx_utils import skipper
+
+if TYPE_CHECKING:
+    from kover_bot.bot2 import KoverBot
+
+
+class NativeDispatcher:
+    """
+    Routes updates to the bot's behaviours with plain function calls, instead of the rx
+    pipelines of KoverBot._setup. Every update is handled in one pass in the same order as
+    the pipelines: chat membership, commands, text triggers, random replies. Handler work
+    goes to the bot's HandlerLimiter, whose per-chat backlogs queue it. The o privet answer
+    is debounced with one timer per chat.
+    """
+
+    def __init__(self, bot: 'KoverBot'):
+        self._bot = bot
+        self._router = bot.create_router()
+        self._random_reply = skipper(*bot.random_reply_skip, stats=bot.skip_stats)
+        self._triggers: dict[str, Callable] = {
+            'kovrobot': bot.on_kovrobot,
+            'ptaag': bot.on_ptaag,
+            'anek': bot.on_anek,
+            'privet': self._privet,
+        }
+        self._commands: dict[str, Callable] = {
+            'svalkopic': bot.on_svalkopic,
+            'kament': bot.on_kament,
+        }
+        self._debounced: dict[int, asyncio.TimerHandle] = {}
+
+    def dispatch(self, update: telegram.Update):
+        bot = self._bot
+        if bot.is_new_chat(update):
+            bot.handle_new_chat(chat_id=update.message.chat.id, username=update.message.chat.username)
+        if bot.is_chat_left(update):
+            bot.chats.remove(update.my_chat_member.chat.id)
+
+        message = update.effective_message
+        if message:
+            command = self._commands.get(message_command(message))
+            if command:
+                command(message)
+
+        message = update.message
+        if message and message.text:
+            for name, match in self._router.match(message).items():
+                trigger = self._triggers.get(name)
+                if trigger:
+                    trigger(message, match)
+            if self._random_reply(message.chat.id):
+                bot.on_random_reply(message)
+
+    def _privet(self, message: telegram.Message, match):
+        handle = self._debounced.pop(message.chat_id, None)
+        if handle:
+            handle.cancel()
+        self._debounced[message.chat_id] = asyncio.get_running_loop().call_later(
+            self._bot.privet_debounce, self._fire_privet, message, match
+        )
+
+    def _fire_privet(self, message: telegram.Message, match):
+        del self._debounced[message.chat_id]
+        self._bot.on_privet(message, match)
+
+    def close(self):
+        for handle in self._debounced.values():
+            handle.cancel()
+        self._debounced.clear()
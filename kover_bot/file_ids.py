@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+import sqlite3
+
+logger = logging.getLogger('root')
+
+
+class FileIdCache:
+    """
+    Persistent map from source image url to the Telegram file_id of its first upload.
+    Lookups are served from memory; new entries are written to SQLite off the event loop.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._file_ids: dict[str, str] = {}
+        self._lock = asyncio.Lock()
+        self._tasks: set[asyncio.Task] = set()
+        self._db: sqlite3.Connection | None = None
+
+    def _open(self) -> dict[str, str]:
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS file_ids (url TEXT PRIMARY KEY, file_id TEXT NOT NULL)')
+        self._db.commit()
+        return dict(self._db.execute('SELECT url, file_id FROM file_ids'))
+
+    async def open(self):
+        self._file_ids = await asyncio.to_thread(self._open)
+        logger.info(f"file_id cache loaded, {len(self._file_ids)} entries")
+
+    async def close(self):
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    def get(self, url: str) -> str | None:
+        return self._file_ids.get(url)
+
+    def put(self, url: str, file_id: str):
+        self._file_ids[url] = file_id
+        self._spawn(self._execute('INSERT OR REPLACE INTO file_ids (url, file_id) VALUES (?, ?)',
+                                  (url, file_id)))
+
+    def discard(self, url: str):
+        if self._file_ids.pop(url, None) is not None:
+            self._spawn(self._execute('DELETE FROM file_ids WHERE url = ?', (url,)))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _write(self, sql: str, params: tuple):
+        self._db.execute(sql, params)
+        self._db.commit()
+
+    async def _execute(self, sql: str, params: tuple):
+        async with self._lock:
+            if not self._db:
+                return
+            try:
+                await asyncio.to_thread(self._write, sql, params)
+            except sqlite3.Error:
+                logger.exception("Error when saving file_id cache")
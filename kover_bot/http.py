@@ -0,0 +1,243 @@
+import asyncio
+import logging
+from array import array
+from functools import partial
+from typing import Awaitable, Callable, Hashable, Sequence, TypeVar
+
+import aiohttp
+
+logger = logging.getLogger('root')
+
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 10
+KEEPALIVE_TIMEOUT = 30
+DNS_CACHE_TTL = 300
+
+TOTAL_TIMEOUT = 30
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+
+T = TypeVar('T')
+
+
+def create_session(trace_configs: Sequence[aiohttp.TraceConfig] = ()) -> aiohttp.ClientSession:
+    """
+    Create the long-lived client session shared by all upstream fetches.
+    Connections are pooled and kept alive, so consecutive fetches from the same host
+    skip the TCP and TLS handshakes.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTION_LIMIT,
+        limit_per_host=CONNECTION_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=TOTAL_TIMEOUT,
+        connect=CONNECT_TIMEOUT,
+        sock_read=READ_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout, trace_configs=list(trace_configs))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call whose result,
+    or exception, every caller gets. A caller being cancelled does not cancel the call
+    for the others.
+    """
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        future = self._calls.get(key)
+        if future is None:
+            future = self._calls[key] = asyncio.ensure_future(call())
+            future.add_done_callback(partial(self._done, key))
+        return await asyncio.shield(future)
+
+    def _done(self, key: Hashable, future: asyncio.Future):
+        del self._calls[key]
+        if not future.cancelled():
+            # mark the exception retrieved, in case every caller has given up already
+            future.exception()
+
+
+class _HostLatency:
+    """Latencies of the last successful requests to one host, with their cached quantile."""
+    __slots__ = ('samples', 'position', 'filled', 'quantile', 'stale',
+                 'requests', 'hedged', 'hedge_wins')
+
+    def __init__(self, window: int):
+        self.samples = array('d', bytes(8 * window))
+        self.position = 0
+        self.filled = 0
+        self.quantile: float | None = None
+        self.stale = 0
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def add(self, latency: float):
+        self.samples[self.position] = latency
+        self.position = (self.position + 1) % len(self.samples)
+        self.filled = min(self.filled + 1, len(self.samples))
+        self.stale += 1
+
+
+class Hedger:
+    """
+    Per-host timeout budgets and hedged requests. A request to a host still running after the
+    host's observed latency quantile gets a second, identical request started alongside it; the
+    first to succeed wins and the other is cancelled. Both together are bounded by the host's
+    budget. At most max_hedge_ratio of a host's requests are hedged, so a slow host does not
+    get its load doubled.
+    """
+
+    def __init__(self, budgets: dict[str, float] | None = None, default_budget: float = TOTAL_TIMEOUT,
+                 quantile: float = 0.95, min_samples: int = 20, window: int = 200,
+                 max_hedge_ratio: float = 0.1):
+        self._budgets = budgets or {}
+        self._default_budget = default_budget
+        self._quantile = quantile
+        self._min_samples = min_samples
+        self._window = window
+        self._max_hedge_ratio = max_hedge_ratio
+        self.hosts: dict[str, _HostLatency] = {}
+
+    def budget(self, host: str) -> float:
+        return self._budgets.get(host, self._default_budget)
+
+    def _host(self, host: str) -> _HostLatency:
+        latency = self.hosts.get(host)
+        if latency is None:
+            latency = self.hosts[host] = _HostLatency(self._window)
+        return latency
+
+    def hedge_delay(self, host: str) -> float | None:
+        """Seconds after which a request to host is hedged, None while too few latencies are known."""
+        latency = self._host(host)
+        if latency.filled < self._min_samples:
+            return None
+        # sorting the window is cheap, but there is no need to do it on every request
+        if latency.quantile is None or latency.stale >= self._min_samples:
+            samples = sorted(latency.samples[:latency.filled])
+            latency.quantile = samples[min(int(len(samples) * self._quantile), len(samples) - 1)]
+            latency.stale = 0
+        return latency.quantile
+
+    async def _timed(self, host: str, call: Callable[[], Awaitable[T]]) -> T:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await call()
+        self._host(host).add(loop.time() - started)
+        return result
+
+    async def fetch(self, host: str, call: Callable[[], Awaitable[T]]) -> T:
+        latency = self._host(host)
+        latency.requests += 1
+        delay = self.hedge_delay(host)
+        async with asyncio.timeout(self.budget(host)):
+            if delay is None or latency.hedged >= self._max_hedge_ratio * latency.requests:
+                return await self._timed(host, call)
+
+            first = asyncio.ensure_future(self._timed(host, call))
+            pending = {first}
+            try:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if done:
+                    return first.result()
+
+                latency.hedged += 1
+                logger.debug(f"hedging a request to {host} after {delay * 1000:.0f}ms")
+                second = asyncio.ensure_future(self._timed(host, call))
+                pending.add(second)
+                while True:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for future in done:
+                        if future.exception() is None:
+                            if future is second:
+                                latency.hedge_wins += 1
+                            return future.result()
+                    if not pending:
+                        # both failed, raise the error of the original request
+                        return first.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+
+class CircuitOpen(aiohttp.ClientError):
+    """Raised instead of making a request to a host whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a failing host. After failure_threshold consecutive failures the circuit
+    opens and requests fail fast with CircuitOpen; after reset_timeout one probe request is let
+    through (half-open), closing the circuit if it succeeds and opening it again if it fails.
+    Used as an async context manager around a request; client errors, timeouts and the
+    server errors the caller raises for count as failures.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.host = host
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.transitions: dict[str, int] = {self.CLOSED: 0, self.OPEN: 0, self.HALF_OPEN: 0}
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    def _set_state(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"circuit for {self.host} {self.state} -> {state}")
+        self.state = state
+        self.transitions[state] += 1
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if asyncio.get_running_loop().time() - self._opened_at < self._reset_timeout:
+                return False
+            self._set_state(self.HALF_OPEN)
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def success(self):
+        self._failures = 0
+        self._probing = False
+        self._set_state(self.CLOSED)
+
+    def failure(self):
+        self._failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self._failures >= self._failure_threshold:
+            self._opened_at = asyncio.get_running_loop().time()
+            self._set_state(self.OPEN)
+
+    async def __aenter__(self):
+        if not self.allow():
+            raise CircuitOpen(f"circuit for {self.host} is open")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.success()
+        elif issubclass(exc_type, (aiohttp.ClientError, asyncio.TimeoutError)):
+            self.failure()
+        else:
+            # cancelled, or failed for reasons of our own, the host is not to blame
+            self._probing = False
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable
+
+import aiohttp
+
+from kover_bot.http import CircuitOpen
+
+logger = logging.getLogger('root')
+
+
+class KamentBuffer:
+    """
+    Bounded queue of ready-to-send kaments, kept full by a background producer.
+    One page fetch fills the queue with many kaments; the producer wakes up again
+    whenever the queue drops below low_water. While fetches are failing and the queue is
+    empty, kaments are picked from the last page that was fetched.
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[list[str]]],
+                 maxsize: int = 100, low_water: int = 10, retry_delay: float = 1):
+        self._fetch = fetch
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize)
+        self._low_water = low_water
+        self._retry_delay = retry_delay
+        self._wanted = asyncio.Event()
+        self._stale: list[str] = []
+        self._failing = False
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._wanted.set()
+        self._task = asyncio.create_task(self._produce())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    async def get(self, timeout: float = 10) -> str:
+        try:
+            kament = self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            self._wanted.set()
+            if self._failing and self._stale:
+                return random.choice(self._stale)
+            try:
+                kament = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return ""
+
+        if self._queue.qsize() < self._low_water:
+            self._wanted.set()
+        return kament
+
+    async def _produce(self):
+        while True:
+            await self._wanted.wait()
+            try:
+                kaments = await self._fetch()
+            except CircuitOpen:
+                kaments = []
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                logger.exception("Error when fetching kaments")
+                kaments = []
+            except Exception:
+                logger.exception("Unexpected error when fetching kaments")
+                kaments = []
+
+            self._failing = not kaments
+            if not kaments:
+                await asyncio.sleep(self._retry_delay)
+                continue
+
+            self._stale = kaments
+
+            random.shuffle(kaments)
+            for kament in kaments:
+                if self._queue.full():
+                    break
+                self._queue.put_nowait(kament)
+
+            logger.debug(f"kament buffer refilled, size={self._queue.qsize()}")
+            if self._queue.qsize() >= self._low_water:
+                self._wanted.clear()
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Coroutine, Hashable
+
+from kover_bot.outbound import Priority
+
+logger = logging.getLogger('root')
+
+
+@dataclass(slots=True)
+class _Work:
+    chat_id: Hashable
+    start: Callable[[], Coroutine[Any, Any, Any]]
+    key: Hashable | None
+
+
+@dataclass(slots=True)
+class _Waiting:
+    direct: deque[_Work] = field(default_factory=deque)
+    background: deque[_Work] = field(default_factory=deque)
+    # whether the chat is queued for a turn at a free slot
+    ready: bool = False
+
+    def __len__(self):
+        return len(self.direct) + len(self.background)
+
+
+class HandlerLimiter:
+    """
+    Runs handler coroutines with at most max_tasks of them running at once and at most per_chat
+    for any one chat. Work over the limits waits in a backlog of its chat, direct work ahead of
+    background work, and chats with waiting work take turns at free slots, so a chat spamming
+    commands only delays itself. A chat's backlog holds at most chat_backlog entries: when it is
+    full its oldest waiting work is shed for new direct work, background before direct, and max_backlog
+    bounds the waiting work of all chats together. Background work is shed first: it is dropped while
+    all max_tasks are busy or the backlogs are full, and at most one piece of it per key waits at a time,
+    later ones are coalesced into it.
+    Handlers are passed as functions creating the coroutine, so dropped work never starts.
+    """
+
+    def __init__(self, max_tasks: int = 64, per_chat: int = 2, max_backlog: int = 1000,
+                 chat_backlog: int = 10):
+        self._max_tasks = max_tasks
+        self._per_chat = per_chat
+        self._max_backlog = max_backlog
+        self._chat_backlog = chat_backlog
+        self._running: dict[Hashable, int] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._waiting: dict[Hashable, _Waiting] = {}
+        # chats with waiting work and a free per-chat slot, in turn order
+        self._ready: deque[Hashable] = deque()
+        self._backlog = 0
+        self._keys: set[Hashable] = set()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def running(self) -> int:
+        return len(self._tasks)
+
+    def backlog(self) -> int:
+        return self._backlog
+
+    def _can_run(self, chat_id: Hashable) -> bool:
+        return len(self._tasks) < self._max_tasks and self._running.get(chat_id, 0) < self._per_chat
+
+    def spawn(self, chat_id: Hashable, start: Callable[[], Coroutine[Any, Any, Any]],
+              priority: Priority = Priority.DIRECT, key: Hashable | None = None):
+        """Run start() now if the limits allow, otherwise queue or drop it."""
+        work = _Work(chat_id, start, key if priority == Priority.BACKGROUND else None)
+        waiting = self._waiting.get(chat_id)
+        if not waiting and self._can_run(chat_id):
+            self._run(work)
+            return
+
+        if priority == Priority.BACKGROUND:
+            if key is not None and key in self._keys:
+                self.coalesced += 1
+                return
+            if (len(self._tasks) >= self._max_tasks or self._backlog >= self._max_backlog
+                    or waiting and len(waiting) >= self._chat_backlog):
+                self._drop(work)
+                return
+        elif waiting and len(waiting) >= self._chat_backlog:
+            self._shed(waiting)
+        elif self._backlog >= self._max_backlog:
+            if not (waiting and waiting.background):
+                logger.warning(f"handler backlog full, dropping a reply to chat {chat_id}")
+                self._drop(work)
+                return
+            self._shed(waiting)
+
+        if waiting is None:
+            waiting = self._waiting[chat_id] = _Waiting()
+        if priority == Priority.BACKGROUND:
+            waiting.background.append(work)
+            if key is not None:
+                self._keys.add(key)
+        else:
+            waiting.direct.append(work)
+        self._backlog += 1
+        self._mark_ready(chat_id)
+        # the work may be runnable already, if only its position in the backlog held it back
+        self._schedule()
+
+    def _shed(self, waiting: _Waiting):
+        evicted = (waiting.background or waiting.direct).popleft()
+        self._keys.discard(evicted.key)
+        self._backlog -= 1
+        self._drop(evicted)
+
+    def _drop(self, work: _Work):
+        self.dropped += 1
+        logger.debug(f"handlers saturated, dropping work for chat {work.chat_id}")
+
+    def _mark_ready(self, chat_id: Hashable):
+        waiting = self._waiting.get(chat_id)
+        if waiting and not waiting.ready and self._running.get(chat_id, 0) < self._per_chat:
+            waiting.ready = True
+            self._ready.append(chat_id)
+
+    def _run(self, work: _Work):
+        self._running[work.chat_id] = self._running.get(work.chat_id, 0) + 1
+        task = asyncio.create_task(work.start())
+        self._tasks.add(task)
+        task.add_done_callback(lambda t: self._done(work.chat_id, t))
+
+    def _done(self, chat_id: Hashable, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._running[chat_id] -= 1
+        if not self._running[chat_id]:
+            del self._running[chat_id]
+        if not task.cancelled() and task.exception():
+            logger.error("Error in handler", exc_info=task.exception())
+        self._mark_ready(chat_id)
+        self._schedule()
+
+    def _schedule(self):
+        # start the oldest waiting work of the next chat in turn, direct work first
+        while self._ready and len(self._tasks) < self._max_tasks:
+            chat_id = self._ready.popleft()
+            waiting = self._waiting[chat_id]
+            waiting.ready = False
+            work = (waiting.direct or waiting.background).popleft()
+            self._backlog -= 1
+            self._keys.discard(work.key)
+            if not waiting:
+                del self._waiting[chat_id]
+            self._run(work)
+            self._mark_ready(chat_id)
+
+    async def close(self):
+        self._waiting.clear()
+        self._ready.clear()
+        self._backlog = 0
+        self._keys.clear()
+        for task in self._tasks:
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
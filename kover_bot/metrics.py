@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from array import array
+from bisect import bisect_left
+from functools import wraps
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger('root')
+
+T = TypeVar('T')
+
+# seconds, upper bounds of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # the last slot counts values above every bucket
+        self.counts = array('Q', bytes(8 * (len(buckets) + 1)))
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metrics:
+    """
+    In-process counters, gauges and latency histograms, rendered in the Prometheus text format
+    and optionally served over http. A disabled Metrics keeps no samples and timed() returns
+    functions unwrapped, so instrumentation costs next to nothing when it is turned off.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._help: dict[str, tuple[str, str, tuple[str, ...]]] = {}
+        self._histograms: dict[str, dict[tuple, Histogram]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._gauges: dict[str, Callable[[], float | dict[tuple, float]]] = {}
+        self._in_flight: dict[str, int] = {}
+        self._runner: web.AppRunner | None = None
+
+        self.histogram('kover_handler_seconds', 'Handler and send latency', ('handler',))
+        self.gauge('kover_handler_in_flight', 'Handler calls in progress',
+                   lambda: {(name,): count for name, count in self._in_flight.items()}, ('handler',))
+        self.counter('kover_errors_total', 'Exceptions raised by handlers', ('handler', 'type'))
+        self.histogram('kover_upstream_seconds', 'Upstream time to response headers', ('host',))
+        self.counter('kover_upstream_requests_total', 'Upstream responses', ('host', 'status'))
+        self.counter('kover_upstream_errors_total', 'Failed upstream requests', ('host', 'type'))
+        self.gauge('kover_tasks', 'Asyncio tasks alive', lambda: len(asyncio.all_tasks()))
+
+    def histogram(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self._help[name] = ('histogram', help, labels)
+        self._histograms[name] = {}
+
+    def counter(self, name: str, help: str, labels: tuple[str, ...] = (),
+                collect: Callable[[], dict[tuple, float]] | None = None):
+        """
+        Register a counter, increased with inc() or, for counts kept elsewhere, read from
+        collect at render time.
+        """
+        self._help[name] = ('counter', help, labels)
+        self._counters[name] = {}
+        if collect:
+            self._gauges[name] = collect
+
+    def gauge(self, name: str, help: str, collect: Callable[[], float | dict[tuple, float]],
+              labels: tuple[str, ...] = ()):
+        """Register a gauge whose value, or values by labels, collect returns at render time."""
+        self._help[name] = ('gauge', help, labels)
+        self._gauges[name] = collect
+
+    def observe(self, name: str, value: float, *labels):
+        if not self.enabled:
+            return
+        series = self._histograms[name]
+        histogram = series.get(labels)
+        if histogram is None:
+            histogram = series[labels] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, *labels, value: float = 1):
+        if not self.enabled:
+            return
+        series = self._counters[name]
+        series[labels] = series.get(labels, 0) + value
+
+    def timed(self, func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        """
+        Wrap a coroutine function to record its latency in kover_handler_seconds, its calls in
+        progress in kover_handler_in_flight and the exceptions it raises in kover_errors_total.
+        """
+        if not self.enabled:
+            return func
+
+        name = func.__name__
+        in_flight = self._in_flight
+        in_flight[name] = 0
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            in_flight[name] += 1
+            try:
+                return await func(*args, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.inc('kover_errors_total', name, type(e).__name__)
+                raise
+            finally:
+                in_flight[name] -= 1
+                self.observe('kover_handler_seconds', loop.time() - started, name)
+
+        return wrapper
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        """
+        Trace config for the client session recording time to response headers and the outcome
+        of every upstream request by host.
+        """
+        config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, context, params):
+            context.started = asyncio.get_running_loop().time()
+
+        async def on_request_end(session, context, params):
+            elapsed = asyncio.get_running_loop().time() - context.started
+            self.observe('kover_upstream_seconds', elapsed, params.url.host)
+            self.inc('kover_upstream_requests_total', params.url.host, params.response.status)
+
+        async def on_request_exception(session, context, params):
+            elapsed = asyncio.get_running_loop().time() - context.started
+            self.observe('kover_upstream_seconds', elapsed, params.url.host)
+            self.inc('kover_upstream_errors_total', params.url.host, type(params.exception).__name__)
+
+        config.on_request_start.append(on_request_start)
+        config.on_request_end.append(on_request_end)
+        config.on_request_exception.append(on_request_exception)
+        return config
+
+    def _series(self) -> Iterable[str]:
+        for name, (kind, help, label_names) in self._help.items():
+            yield f'# HELP {name} {help}'
+            yield f'# TYPE {name} {kind}'
+            if kind == 'histogram':
+                for labels, histogram in self._histograms[name].items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        le = f'le="{bound}"'
+                        yield f'{name}_bucket{_labels(label_names, labels, le)} {cumulative}'
+                    le = 'le="+Inf"'
+                    yield f'{name}_bucket{_labels(label_names, labels, le)} {histogram.count}'
+                    yield f'{name}_sum{_labels(label_names, labels)} {histogram.sum}'
+                    yield f'{name}_count{_labels(label_names, labels)} {histogram.count}'
+            elif kind == 'counter' and name not in self._gauges:
+                for labels, value in self._counters[name].items():
+                    yield f'{name}{_labels(label_names, labels)} {value}'
+            else:
+                values = self._gauges[name]()
+                if not isinstance(values, dict):
+                    values = {(): values}
+                for labels, value in values.items():
+                    yield f'{name}{_labels(label_names, labels)} {value}'
+
+    def render(self) -> str:
+        return '\n'.join(self._series()) + '\n'
+
+    async def start(self, host: str, port: int):
+        """Serve the metrics at http://host:port/metrics."""
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(body=self.render().encode('utf-8'),
+                                headers={'Content-Type': CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Serving metrics on {host}:{port}")
+
+    async def close(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,201 @@
+import asyncio
+import heapq
+import logging
+from dataclasses import dataclass, field
+from enum import IntEnum
+from itertools import count
+from typing import Any, Awaitable, Callable, Hashable
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger('root')
+
+
+class Priority(IntEnum):
+    # replies to commands, mentions and triggers
+    DIRECT = 0
+    # random kaments, auto pics
+    BACKGROUND = 1
+
+
+@dataclass(order=True, slots=True)
+class _Job:
+    priority: int
+    seq: int
+    send: Callable[[], Awaitable[Any]] = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    retries: int = field(default=0, compare=False)
+
+
+@dataclass(slots=True)
+class _ChatQueue:
+    interval: float
+    jobs: list[_Job] = field(default_factory=list)
+    next_ready: float = 0
+    scheduled: bool = False
+
+
+class SendScheduler:
+    """
+    Central queue for outgoing Telegram requests.
+    Sends to one chat are spaced at least chat_interval apart and all sends together are
+    kept under global_rate per second. Direct replies go before background traffic, and
+    a send that hits RetryAfter is put back in its chat's queue until the flood wait is over.
+    Requests submitted with chat_id=None are only subject to the global limit.
+    """
+    PRUNE_INTERVAL = 60
+
+    def __init__(self, chat_interval: float = 1, global_rate: float = 30, max_retries: int = 3):
+        self._chat_interval = chat_interval
+        self._global_interval = 1 / global_rate
+        self._max_retries = max_retries
+        self._chats: dict[Hashable, _ChatQueue] = {}
+        self._seq = count()
+        # (priority, seq, chat_id) of chats whose next job may be sent now
+        self._ready: list[tuple[int, int, Hashable]] = []
+        # (ready time, seq, chat_id) of chats that have jobs but are rate limited
+        self._waiting: list[tuple[float, int, Hashable]] = []
+        self._next_global = 0
+        self._next_prune = 0
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._sending: set[asyncio.Task] = set()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._sending:
+            await asyncio.gather(*self._sending, return_exceptions=True)
+
+    def qsize(self) -> int:
+        return sum(len(chat.jobs) for chat in self._chats.values())
+
+    async def submit(self, chat_id: Hashable | None, send: Callable[[], Awaitable[Any]],
+                     priority: Priority = Priority.DIRECT) -> Any:
+        job = _Job(priority, next(self._seq), send, asyncio.get_running_loop().create_future())
+        self._push(chat_id, job)
+        return await job.future
+
+    def _chat(self, chat_id: Hashable | None) -> _ChatQueue:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _ChatQueue(0 if chat_id is None else self._chat_interval)
+        return chat
+
+    def _push(self, chat_id: Hashable | None, job: _Job):
+        chat = self._chat(chat_id)
+        heapq.heappush(chat.jobs, job)
+        if not chat.scheduled:
+            self._schedule(chat_id, chat)
+        elif chat.jobs[0] is job and chat.next_ready <= asyncio.get_running_loop().time():
+            # the chat is queued as ready under its previous head, queue it again under this one
+            heapq.heappush(self._ready, (job.priority, job.seq, chat_id))
+        self._wakeup.set()
+
+    def _schedule(self, chat_id: Hashable | None, chat: _ChatQueue):
+        chat.scheduled = True
+        now = asyncio.get_running_loop().time()
+        if chat.next_ready <= now:
+            head = chat.jobs[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+        else:
+            heapq.heappush(self._waiting, (chat.next_ready, next(self._seq), chat_id))
+
+    def _promote(self, now: float):
+        while self._waiting and self._waiting[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._waiting)
+            chat = self._chats[chat_id]
+            if chat.next_ready > now:
+                # pushed back by a flood wait after it was scheduled
+                heapq.heappush(self._waiting, (chat.next_ready, next(self._seq), chat_id))
+                continue
+            head = chat.jobs[0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _prune(self, now: float):
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.PRUNE_INTERVAL
+        idle = [chat_id for chat_id, chat in self._chats.items()
+                if not chat.jobs and not chat.scheduled and chat.next_ready <= now]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            self._promote(now)
+
+            if not self._ready:
+                self._prune(now)
+                self._wakeup.clear()
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            if self._next_global > now:
+                await asyncio.sleep(self._next_global - now)
+                # a more urgent job may have arrived meanwhile
+                continue
+
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            chat = self._chats.get(chat_id)
+            if not chat or not chat.jobs or (chat.jobs[0].priority, chat.jobs[0].seq) != (priority, seq):
+                # stale entry, the chat's head has changed since it was queued
+                continue
+            if chat.next_ready > now:
+                heapq.heappush(self._waiting, (chat.next_ready, next(self._seq), chat_id))
+                continue
+
+            job = heapq.heappop(chat.jobs)
+            chat.scheduled = False
+            if job.future.done():
+                # the submitter has given up on it
+                if chat.jobs:
+                    self._schedule(chat_id, chat)
+                continue
+
+            self._next_global = now + self._global_interval
+            chat.next_ready = now + chat.interval
+            if chat.jobs:
+                self._schedule(chat_id, chat)
+
+            task = asyncio.create_task(self._send(chat_id, job))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id: Hashable | None, job: _Job):
+        try:
+            result = await job.send()
+        except RetryAfter as e:
+            if job.retries >= self._max_retries:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            logger.warning(f"RetryAfter {e.retry_after} when sending to {chat_id}")
+            job.retries += 1
+            chat = self._chat(chat_id)
+            retry_at = asyncio.get_running_loop().time() + _seconds(e.retry_after)
+            chat.next_ready = max(chat.next_ready, retry_at)
+            self._push(chat_id, job)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+def _seconds(retry_after) -> float:
+    return retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from time import monotonic
+from typing import Callable, TypeVar
+
+logger = logging.getLogger('root')
+
+T = TypeVar('T')
+
+
+@dataclass(slots=True)
+class ParseStats:
+    count: int = 0
+    wait_total: float = 0
+    wait_max: float = 0
+    run_total: float = 0
+    run_max: float = 0
+
+    def add(self, wait: float, run: float):
+        self.count += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.run_total += run
+        self.run_max = max(self.run_max, run)
+
+
+def _timed(func: Callable[[bytes], T], html: bytes) -> tuple[T, float, float]:
+    # monotonic() is system-wide, so the timestamps are comparable across worker processes
+    started = monotonic()
+    result = func(html)
+    return result, started, monotonic()
+
+
+class ParserPool:
+    """
+    Runs scrapers in a thread or process pool, so html parsing never blocks the event loop.
+    Time spent waiting for a free worker and time spent parsing are tracked per scraper.
+    """
+
+    def __init__(self, workers: int = 2, processes: bool = False):
+        self._executor: Executor = (
+            ProcessPoolExecutor(workers) if processes else
+            ThreadPoolExecutor(workers, thread_name_prefix='parser')
+        )
+        self.stats: dict[str, ParseStats] = {}
+
+    async def parse(self, func: Callable[[bytes], T], html: bytes) -> T:
+        submitted = monotonic()
+        result, started, finished = await asyncio.get_running_loop().run_in_executor(
+            self._executor, _timed, func, html
+        )
+        wait, run = started - submitted, finished - started
+
+        name = func.__name__
+        if name not in self.stats:
+            self.stats[name] = ParseStats()
+        self.stats[name].add(wait, run)
+        logger.debug(f"{name}: waited {wait * 1000:.1f}ms, parsed in {run * 1000:.1f}ms")
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,35 @@
+from io import BytesIO
+
+import aiohttp
+
+# Telegram refuses photos larger than 10 MB anyway
+MAX_IMAGE_SIZE = 10 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class ImageRejected(Exception):
+    pass
+
+
+async def read_image(response: aiohttp.ClientResponse,
+                     max_size: int = MAX_IMAGE_SIZE, chunk_size: int = CHUNK_SIZE) -> BytesIO:
+    """
+    Read an upstream image body chunk by chunk, for relaying it to Telegram.
+    Non-image and oversize responses are rejected from their headers before any of the
+    body is read; a body that turns out longer than announced is cut off at max_size.
+    """
+    if response.status != 200:
+        raise ImageRejected(f"{response.url}: status {response.status}")
+    if not response.content_type.startswith('image/'):
+        raise ImageRejected(f"{response.url}: content type {response.content_type}")
+    if response.content_length is not None and response.content_length > max_size:
+        raise ImageRejected(f"{response.url}: {response.content_length} bytes")
+
+    buffer = BytesIO()
+    async for chunk in response.content.iter_chunked(chunk_size):
+        if buffer.tell() + len(chunk) > max_size:
+            raise ImageRejected(f"{response.url}: more than {max_size} bytes")
+        buffer.write(chunk)
+
+    buffer.seek(0)
+    return buffer
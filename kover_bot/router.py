@@ -0,0 +1,75 @@
+import re
+from typing import Callable
+
+from reactivex import Observable
+from reactivex.subject import Subject
+from telegram import Message, MessageEntity
+
+
+def message_command(message: Message) -> str | None:
+    """
+    Name of the bot command the message starts with, without the @botname suffix.
+    """
+    if not message.entities or not message.text:
+        return None
+    entity = message.entities[0]
+    if entity.type != MessageEntity.BOT_COMMAND or entity.offset != 0:
+        return None
+    return message.text[1: entity.length].split('@')[0].lower()
+
+
+class TriggerRouter:
+    """
+    Routes incoming messages to per-trigger and per-command observables in a single pass.
+    All trigger patterns are compiled into one regex with a named group per trigger, so every
+    message text is scanned once however many triggers there are; commands are looked up by
+    the bot_command entity. Trigger observables emit (message, match) pairs, with match None
+    when the trigger was fired by a check rather than by its pattern; command observables
+    emit messages.
+    """
+
+    def __init__(self, patterns: dict[str, str], flags: int = re.IGNORECASE):
+        self._re = re.compile('|'.join(f'(?P<{name}>{pattern})' for name, pattern in patterns.items()),
+                              flags)
+        self._triggers: dict[str, Subject] = {}
+        self._checks: list[tuple[str, Callable[[Message], bool]]] = []
+        self._commands: dict[str, Subject] = {}
+
+    def trigger(self, name: str) -> Observable:
+        if name not in self._triggers:
+            self._triggers[name] = Subject()
+        return self._triggers[name]
+
+    def command(self, name: str) -> Observable:
+        if name not in self._commands:
+            self._commands[name] = Subject()
+        return self._commands[name]
+
+    def add_check(self, name: str, check: Callable[[Message], bool]):
+        """Also fire trigger name for messages the check returns True for."""
+        self._checks.append((name, check))
+
+    def classify(self, text: str) -> dict[str, re.Match]:
+        fired = {}
+        for match in self._re.finditer(text):
+            if match.lastgroup not in fired:
+                fired[match.lastgroup] = match
+        return fired
+
+    def route_command(self, message: Message):
+        command = message_command(message)
+        if command is not None and command in self._commands:
+            self._commands[command].on_next(message)
+
+    def match(self, message: Message) -> dict[str, re.Match | None]:
+        """Triggers the message fires, by its text or by a check."""
+        fired: dict[str, re.Match | None] = self.classify(message.text)
+        for name, check in self._checks:
+            if name not in fired and check(message):
+                fired[name] = None
+        return fired
+
+    def route_text(self, message: Message):
+        for name, match in self.match(message).items():
+            if name in self._triggers:
+                self._triggers[name].on_next((message, match))
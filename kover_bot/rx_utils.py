@@ -1,46 +1,156 @@
 import random
-from time import time
+from array import array
+from math import inf
+from time import monotonic
 from typing import Any, Callable, Hashable
 
 import reactivex as rx
 
 
+class SkipStats:
+    """
+    Per-partition counters of skip_some, stored column-wise in typed arrays.
+    Partitions idle for longer than idle_timeout are evicted, and once there are more than
+    max_partitions the least recently seen ones are dropped down to 90% of the limit.
+    Times come from a monotonic clock.
+    """
+
+    def __init__(self, max_partitions: int = 100_000, idle_timeout: float = 7 * 24 * 3600,
+                 clock: Callable[[], float] = monotonic):
+        self.max_partitions = max_partitions
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self.index: dict[Hashable, int] = {}
+        self.keys: list[Hashable | None] = []
+        self.skipped = array('i')
+        self.to_skip = array('i')
+        self.deadline = array('d')
+        self.last_seen = array('d')
+        self.removed: set[Hashable] = set()
+        self._free: list[int] = []
+        self._next_sweep = clock() + idle_timeout / 10
+        self._drained_at = -inf
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, key: Hashable, skipped: int, to_skip: int, deadline: float, now: float):
+        if self._free:
+            i = self._free.pop()
+            self.keys[i] = key
+            self.skipped[i] = skipped
+            self.to_skip[i] = to_skip
+            self.deadline[i] = deadline
+            self.last_seen[i] = now
+        else:
+            i = len(self.keys)
+            self.keys.append(key)
+            self.skipped.append(skipped)
+            self.to_skip.append(to_skip)
+            self.deadline.append(deadline)
+            self.last_seen.append(now)
+        self.index[key] = i
+        self.removed.discard(key)
+
+        if len(self.index) > self.max_partitions or now >= self._next_sweep:
+            self._evict(now)
+
+    def _evict(self, now: float):
+        self._next_sweep = now + self.idle_timeout / 10
+        last_seen = self.last_seen
+        evicted = [i for i in self.index.values() if last_seen[i] + self.idle_timeout <= now]
+
+        excess = len(self.index) - len(evicted) - self.max_partitions
+        if excess > 0:
+            excess += self.max_partitions // 10
+            evicted_set = set(evicted)
+            evicted.extend(sorted(
+                (i for i in self.index.values() if i not in evicted_set), key=last_seen.__getitem__
+            )[:excess])
+
+        for i in evicted:
+            key = self.keys[i]
+            del self.index[key]
+            self.keys[i] = None
+            self._free.append(i)
+            self.removed.add(key)
+
+    def load(self, dumped: dict[Hashable, tuple[int, int, float]]):
+        now = self.clock()
+        for key, (skipped, to_skip, wait_left) in dumped.items():
+            self.add(key, skipped, to_skip, now + wait_left, now)
+        self.removed.clear()
+        self._drained_at = now
+
+    def drain_changes(self) -> tuple[dict[Hashable, tuple[int, int, float]], set[Hashable]]:
+        """
+        (skipped, to_skip, seconds left to wait) of the partitions seen since the previous
+        call, and the partitions evicted since then; for persisting the counters.
+        """
+        now = self.clock()
+        since, self._drained_at = self._drained_at, now
+        skipped, to_skip, deadline, last_seen = self.skipped, self.to_skip, self.deadline, self.last_seen
+        changed = {
+            key: (skipped[i], to_skip[i], max(deadline[i] - now, 0))
+            for key, i in self.index.items()
+            if last_seen[i] >= since
+        }
+        removed, self.removed = self.removed, set()
+        return changed, removed
+
+
+def skipper(min_skip: int, max_skip: int, min_time: float, max_time: float,
+            stats: SkipStats | None = None) -> Callable[[Hashable], bool]:
+    """
+    Function telling for every value of a partition whether it passes: between min_skip and
+    max_skip values, and between min_time and max_time seconds, whichever comes last, are
+    skipped, then the counters are reset.
+    """
+    counters = stats if stats is not None else SkipStats()
+    clock, index = counters.clock, counters.index
+    skipped, to_skip, deadline, last_seen = (
+        counters.skipped, counters.to_skip, counters.deadline, counters.last_seen
+    )
+    randint, rand = random.randint, random.random
+
+    def passes(partition_key: Hashable) -> bool:
+        now = clock()
+        try:
+            i = index[partition_key]
+        except KeyError:
+            wait = rand() * (max_time - min_time) + min_time
+            counters.add(partition_key, 0, randint(min_skip, max_skip), now + wait, now)
+            return False
+
+        last_seen[i] = now
+        n = skipped[i]
+        if n < to_skip[i] or deadline[i] > now:
+            skipped[i] = n + 1
+            return False
+        skipped[i] = 0
+        to_skip[i] = randint(min_skip, max_skip)
+        deadline[i] = now + rand() * (max_time - min_time) + min_time
+        return True
+
+    return passes
+
+
 def skip_some(min_skip: int, max_skip: int, min_time: float, max_time: float,
-              partition: Callable[[Any], Hashable]):
+              partition: Callable[[Any], Hashable],
+              stats: SkipStats | None = None):
     """
     Skip between min_skip and max_skip values, and between min_time and max_time seconds,
     whichever comes last, then reset the counters.
+    Pass stats to keep the counters in a store owned by the caller, e.g. to persist them.
     """
 
     def _skip_some(source):
         def subscribe(observer, scheduler=None):
-            stats: dict[Hashable, dict[str, Any]] = {}
-
-            def _reset_stats(partition_key):
-                if partition_key not in stats:
-                    stats[partition_key] = {}
-
-                stats[partition_key].update({
-                    'skipped': 0,
-                    'last_message': time(),
-                    'to_skip': random.randint(min_skip, max_skip),
-                    'to_wait': random.random() * (max_time - min_time) + min_time,
-                })
+            passes = skipper(min_skip, max_skip, min_time, max_time, stats)
 
             def on_next(value):
-                partition_key = partition(value)
-                if partition_key not in stats:
-                    _reset_stats(partition_key)
-
-                elif (
-                        stats[partition_key]['skipped'] >= stats[partition_key]['to_skip'] and
-                        stats[partition_key]['last_message'] + stats[partition_key]['to_wait']
-                        <= time()
-                ):
+                if passes(partition(value)):
                     observer.on_next(value)
-                    _reset_stats(partition_key)
-                else:
-                    stats[partition_key]['skipped'] += 1
 
             return source.subscribe(
                 on_next,
@@ -0,0 +1,253 @@
+"""
+Extraction functions for the svalko.org and baneks.ru pages the bot scrapes.
+Flat lookups run on a streaming tokenizer, and functions that need element subtrees
+only build those (via SoupStrainer); all of them return plain values.
+"""
+import re
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, SoupStrainer, UnicodeDammit
+from bs4.builder import HTMLTreeBuilder
+
+image_view_re = re.compile(r"^javascript: image_view\(\'svalko\.org\', \'(.*?)\', \d+, \d+\);$")
+tag_href_re = re.compile(r'^/tag/.*', re.IGNORECASE)
+
+MAX_KAMENT_LENGTH = 500
+
+_postings = SoupStrainer('div', attrs={'class': 'posting'})
+_anek = SoupStrainer('section', attrs={'class': 'anek-view'})
+
+
+@dataclass(slots=True)
+class Tag:
+    name: str
+    tag_id: str
+
+
+@dataclass(slots=True)
+class Post:
+    text: str
+    image_url: str | None = None
+
+
+def _parse(html: bytes | str, strainer: SoupStrainer) -> BeautifulSoup:
+    return BeautifulSoup(html, "html.parser", parse_only=strainer)
+
+
+def _decode(html: bytes | str) -> str:
+    if isinstance(html, str):
+        return html
+    return UnicodeDammit(html, is_html=True).unicode_markup or ''
+
+
+def _classes(attrs: list[tuple[str, str | None]]) -> list[str]:
+    for name, value in attrs:
+        if name == 'class':
+            return (value or '').split()
+    return []
+
+
+class _Done(Exception):
+    pass
+
+
+class _LinkParser(HTMLParser):
+    def __init__(self, href_re: re.Pattern):
+        super().__init__()
+        self.href_re = href_re
+        self.links: list[tuple[str, str]] = []
+        self._href = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'a':
+            return
+        for name, value in attrs:
+            if name == 'href' and value and self.href_re.match(value):
+                self._href = value
+                self._text = []
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._href is not None:
+            self.links.append((self._href, ''.join(self._text)))
+            self._href = None
+
+
+@dataclass(slots=True)
+class _Comment:
+    slot: int
+    depth: int
+    text_depth: int = 0
+    all: list[str] = field(default_factory=list)
+    text: list[str] = field(default_factory=list)
+
+
+class _CommentParser(HTMLParser):
+    """
+    Collects (whole text, first div.text text) for every div.comment in document order, as
+    find_all would: a comment nested in another is also collected on its own, end tags close
+    the elements BeautifulSoup would close, and comments still open at the end of the page
+    are closed there.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.comments: list[tuple[str, str]] = []
+        self._tags: list[str] = []
+        self._open: list[_Comment] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in HTMLTreeBuilder.DEFAULT_EMPTY_ELEMENT_TAGS:
+            return
+        self._tags.append(tag)
+        if tag != 'div':
+            return
+        depth = len(self._tags)
+        classes = _classes(attrs)
+        if 'text' in classes:
+            for comment in self._open:
+                if not comment.text_depth:
+                    comment.text_depth = depth
+        if 'comment' in classes:
+            self._open.append(_Comment(len(self.comments), depth))
+            self.comments.append(('', ''))
+
+    def handle_data(self, data):
+        for comment in self._open:
+            comment.all.append(data)
+            if comment.text_depth > 0:
+                comment.text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag not in self._tags:
+            return
+        while True:
+            depth = len(self._tags)
+            name = self._tags.pop()
+            if name == 'div':
+                self._end_div(depth)
+            if name == tag:
+                break
+
+    def _end_div(self, depth: int):
+        for comment in self._open:
+            if comment.text_depth == depth:
+                # only the first div.text of a comment counts
+                comment.text_depth = -1
+        if self._open and self._open[-1].depth == depth:
+            self._finish(self._open.pop())
+
+    def close(self):
+        super().close()
+        while self._open:
+            self._finish(self._open.pop())
+
+    def _finish(self, comment: _Comment):
+        self.comments[comment.slot] = (''.join(comment.all), ''.join(comment.text))
+
+
+class _PagingParser(HTMLParser):
+    """Finds the text of the first <b> in div.paging, then stops."""
+
+    def __init__(self):
+        super().__init__()
+        self.current: str | None = None
+        self._depth = 0
+        self._in_b = False
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'div':
+            if self._depth:
+                self._depth += 1
+            elif 'paging' in _classes(attrs):
+                self._depth = 1
+        elif tag == 'b' and self._depth:
+            self._in_b = True
+
+    def handle_data(self, data):
+        if self._in_b:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'b' and self._in_b:
+            self.current = ''.join(self._text)
+            raise _Done
+        if tag == 'div' and self._depth:
+            self._depth -= 1
+
+
+def _feed(parser: HTMLParser, html: bytes | str):
+    try:
+        parser.feed(_decode(html))
+        parser.close()
+    except _Done:
+        pass
+
+
+def parse_kaments(html: bytes | str) -> list[str]:
+    """svalko.org/random.html: texts of all reasonably short comments."""
+    parser = _CommentParser()
+    _feed(parser, html)
+    return [
+        text for whole, text in parser.comments
+        if len(whole) < MAX_KAMENT_LENGTH and whole.strip() and text.strip()
+    ]
+
+
+def parse_tags(html: bytes | str) -> list[Tag]:
+    """svalko.org/tags.html: every tag link."""
+    parser = _LinkParser(tag_href_re)
+    _feed(parser, html)
+    return [
+        Tag(name=text, tag_id=href.replace('/tag/', ''))
+        for href, text in parser.links
+        if text.strip()
+    ]
+
+
+def parse_tag_pages(html: bytes | str) -> int:
+    """svalko.org/tag/<id>: number of pages with posts under the tag."""
+    parser = _PagingParser()
+    _feed(parser, html)
+    if not parser.current:
+        return 0
+    return int(parser.current.strip('[]'))
+
+
+def parse_posts(html: bytes | str) -> list[Post]:
+    """svalko.org/page/<n>: text and first image of every post on the page."""
+    posts = []
+    for posting in _parse(html, _postings).find_all('div', attrs={'class': 'posting'}):
+        post = posting.find('div', attrs={'class': 'text'})
+        if not post:
+            continue
+        tags = post.find('div', attrs={'class': 'tags'})
+        if tags:
+            tags.decompose()
+        pictag = post.find('img')
+        posts.append(Post(
+            text=post.text,
+            image_url=pictag.attrs.get('src') if pictag else None,
+        ))
+    return posts
+
+
+def parse_image_names(html: bytes | str) -> list[str]:
+    """svalko.org/images.html: file names of all images in the gallery."""
+    parser = _LinkParser(image_view_re)
+    _feed(parser, html)
+    return [image_view_re.match(href).group(1) for href, _ in parser.links]
+
+
+def parse_anek(html: bytes | str) -> str | None:
+    """baneks.ru/random: text of the anek."""
+    anek = _parse(html, _anek).find('section', attrs={'class': 'anek-view'})
+    if not anek or not anek.find('p'):
+        return None
+    return anek.find('p').text
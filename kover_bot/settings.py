@@ -0,0 +1,101 @@
+import os
+from dataclasses import dataclass, fields
+
+
+@dataclass
+class Settings:
+    data_dir: str = 'data'
+    log_level: str = 'INFO'
+    # seconds between two checkpoints of the bot state
+    state_interval: float = 5
+    # chats whose random-reply counters are kept, least recently active ones are dropped
+    skip_partitions: int = 100_000
+
+    # size and kind of the pool html parsing runs in
+    parser_workers: int = 2
+    parser_processes: bool = False
+
+    # seconds between two background fetches into the anek corpus
+    anek_refresh_interval: float = 30
+
+    # handler tasks running at once, overall and for one chat, and handler work allowed to wait,
+    # overall and for one chat
+    handler_tasks: int = 64
+    handler_tasks_per_chat: int = 2
+    handler_backlog: int = 1000
+    handler_backlog_per_chat: int = 10
+
+    # engine routing updates to the handlers, 'rx' pipelines or the plain 'native' dispatcher
+    dispatcher: str = 'rx'
+
+    # handle updates in this many worker processes, sharded by chat id, 0 handles them in-process
+    workers: int = 0
+    # index of this worker process when sharded, set by the ingest for each worker
+    worker_index: int = -1
+    # batches of updates waiting for one worker before polling is held up
+    worker_queue: int = 100
+
+    # seconds before an auto pic is due that it is fetched
+    auto_pic_lead: float = 30
+
+    # updates fetched per getUpdates call, at most 100
+    updates_limit: int = 100
+    # minimal interval between two messages sent to the same chat
+    send_interval: float = 1
+    # messages per second over all chats
+    send_rate: float = 30
+    # resends of a message after a RetryAfter
+    send_retries: int = 3
+
+    # upstream base urls, without the trailing slash
+    svalko_url: str = 'https://svalko.org'
+    baneks_url: str = 'http://baneks.ru'
+    telegram_api_url: str = 'https://api.telegram.org'
+
+    # seconds a request to the host may take, hedges included
+    svalko_timeout: float = 10
+    baneks_timeout: float = 10
+    # requests running longer than this quantile of the host's recent latencies are hedged
+    hedge_quantile: float = 0.95
+    # share of the requests to one host that may be hedged, 0 turns hedging off
+    hedge_ratio: float = 0.1
+
+    # consecutive failures that open a host's circuit, and seconds before it is probed again
+    breaker_failures: int = 5
+    breaker_reset: float = 30
+
+    # serve prometheus metrics at http://metrics_host:metrics_port/metrics, off when the port is 0
+    metrics_host: str = '127.0.0.1'
+    metrics_port: int = 0
+
+    # receive updates through a webhook instead of long polling when webhook_url is set,
+    # webhook_secret is then required, Telegram sends it with every update
+    webhook_url: str = ''
+    webhook_secret: str = ''
+    webhook_host: str = '0.0.0.0'
+    webhook_port: int = 8080
+    webhook_path: str = '/telegram'
+
+    def __post_init__(self):
+        if self.webhook_url and not self.webhook_secret:
+            raise ValueError("webhook_secret is required with webhook_url")
+
+    @classmethod
+    def from_env(cls) -> 'Settings':
+        """
+        Read settings from environment variables named after the fields, e.g. PARSER_WORKERS.
+        """
+        values = {}
+        for f in fields(cls):
+            value = os.getenv(f.name.upper())
+            if value is None:
+                continue
+            if f.type in (bool, 'bool'):
+                values[f.name] = value.lower() in ('1', 'true', 'yes', 'on')
+            elif f.type in (int, 'int'):
+                values[f.name] = int(value)
+            elif f.type in (float, 'float'):
+                values[f.name] = float(value)
+            else:
+                values[f.name] = value
+        return cls(**values)
@@ -0,0 +1,170 @@
+import asyncio
+import dataclasses
+import glob
+import logging
+import multiprocessing
+import os
+from queue import Full
+
+import telegram
+
+from kover_bot.bot2 import KoverBot, poll_updates
+from kover_bot.settings import Settings
+from kover_bot.state import State, StateStore, move_chats
+
+logger = logging.getLogger('root')
+
+
+def shard_of(update: telegram.Update, workers: int) -> int:
+    """
+    Worker an update belongs to: all updates of one chat go to the same worker.
+    KoverBot.create drops the stored chats of other workers by the same rule.
+    """
+    chat = update.effective_chat
+    return chat.id % workers if chat else 0
+
+
+def worker_settings(settings: Settings, index: int) -> Settings:
+    """
+    Settings of one worker: its own data dir, so every worker keeps the state of its chats,
+    and its own metrics port, if metrics are on.
+    """
+    return dataclasses.replace(
+        settings,
+        data_dir=os.path.join(settings.data_dir, f'worker{index}'),
+        metrics_port=settings.metrics_port + 1 + index if settings.metrics_port else 0,
+        worker_index=index,
+    )
+
+
+def reshard(settings: Settings):
+    """
+    Move the chats stored by the workers to the worker owning them under the current number
+    of workers, so changing it loses no auto pic periods or skip counters. Also empties the
+    data dirs of workers that no longer exist.
+    """
+    def path(index: int) -> str:
+        return os.path.join(worker_settings(settings, index).data_dir, 'state.sqlite3')
+
+    paths = sorted(glob.glob(os.path.join(glob.escape(settings.data_dir), 'worker*', 'state.sqlite3')))
+    move_chats(paths, lambda chat_id: path(chat_id % settings.workers))
+
+
+async def _work(token: str, settings: Settings, queue: multiprocessing.Queue):
+    bot = await KoverBot.create(token, settings)
+    try:
+        await bot.run_worker(queue)
+    finally:
+        await bot.close()
+
+
+def _run_worker(token: str, settings: Settings, queue: multiprocessing.Queue):
+    try:
+        asyncio.run(_work(token, settings, queue))
+    except KeyboardInterrupt:
+        pass
+
+
+class Ingest:
+    """
+    Owns getUpdates and the update offset, and fans the updates out to worker processes
+    by chat id, so per-chat state like skip_some counters and auto-pic timers lives in
+    exactly one worker. Every poll becomes at most one batch per worker; a worker that
+    falls behind fills its bounded queue and holds up polling. A worker that died is
+    restarted with a new queue, the updates queued for it are lost.
+    Every worker runs its own kament, tag and anek producers, so the upstream sites see
+    that load once per worker.
+    """
+
+    # seconds to wait for room in a worker queue before checking that the worker is alive
+    put_timeout = 1
+
+    def __init__(self, token: str, settings: Settings):
+        self._token = token
+        self._settings = settings
+        self._workers = settings.workers
+        self._context = multiprocessing.get_context('spawn')
+        self._queues = [self._context.Queue(settings.worker_queue) for _ in range(self._workers)]
+        self._processes: list[multiprocessing.Process] = []
+        self.update_id: int | None = None
+        self.bot = telegram.Bot(token,
+                                base_url=f"{settings.telegram_api_url}/bot",
+                                base_file_url=f"{settings.telegram_api_url}/file/bot")
+        self.state = StateStore(os.path.join(settings.data_dir, 'ingest.sqlite3'), settings.state_interval)
+
+    def _start_worker(self, index: int) -> multiprocessing.Process:
+        # not a daemon, daemonic processes cannot have children of their own like a parser process pool
+        process = self._context.Process(
+            target=_run_worker, name=f'kover-worker{index}',
+            args=(self._token, worker_settings(self._settings, index), self._queues[index]),
+        )
+        process.start()
+        return process
+
+    def _restart_worker(self, index: int):
+        process = self._processes[index]
+        logger.error(f"{process.name} died with exit code {process.exitcode}, restarting it, "
+                     f"the updates queued for it are dropped")
+        # a worker dying while it reads may leave the queue locked, so it is replaced as well
+        self._queues[index].cancel_join_thread()
+        self._queues[index].close()
+        self._queues[index] = self._context.Queue(self._settings.worker_queue)
+        self._processes[index] = self._start_worker(index)
+
+    async def start(self):
+        await asyncio.to_thread(reshard, self._settings)
+        self._processes = [self._start_worker(index) for index in range(self._workers)]
+        logger.info(f"started {self._workers} workers")
+
+        await self.bot.initialize()
+        self.update_id = (await self.state.load()).update_id
+        self.state.start(lambda: State(update_id=self.update_id))
+
+    async def close(self):
+        for queue in self._queues:
+            try:
+                await asyncio.to_thread(queue.put, None, True, self.put_timeout)
+            except Full:
+                pass
+        for process in self._processes:
+            await asyncio.to_thread(process.join, 30)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop, terminating")
+                process.terminate()
+        await self.state.close()
+        await self.bot.shutdown()
+
+    async def dispatch(self, updates: list[telegram.Update]):
+        batches: list[list[dict]] = [[] for _ in range(self._workers)]
+        for update in updates:
+            batches[shard_of(update, self._workers)].append(update.to_dict())
+        for index, batch in enumerate(batches):
+            if batch:
+                await self._put(index, batch)
+
+    async def _put(self, index: int, batch: list[dict]):
+        while True:
+            if not self._processes[index].is_alive():
+                self._restart_worker(index)
+            try:
+                await asyncio.to_thread(self._queues[index].put, batch, True, self.put_timeout)
+                return
+            except Full:
+                pass
+
+    async def run(self):
+        if self._settings.webhook_url:
+            logger.warning("webhook_url is ignored with workers, polling for updates")
+        await self.bot.delete_webhook()
+        async for updates in poll_updates(self.bot, self.update_id, self._settings.updates_limit):
+            await self.dispatch(updates)
+            self.update_id = updates[-1].update_id + 1
+
+
+async def run_sharded(token: str, settings: Settings):
+    ingest = Ingest(token, settings)
+    await ingest.start()
+    try:
+        await ingest.run()
+    finally:
+        await ingest.close()
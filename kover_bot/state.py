@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from typing import Callable
+
+logger = logging.getLogger('root')
+
+
+@dataclass
+class ChatState:
+    chat_id: int
+    username: str | None
+    svalko_pic_period: float | None
+
+
+@dataclass
+class State:
+    update_id: int | None = None
+    chats: list[ChatState] = field(default_factory=list)
+    # skip_some counters as (skipped, to_skip, seconds left to wait); on checkpoints
+    # only the counters changed since the previous one, plus the evicted partitions
+    skip_stats: dict[int, tuple[int, int, float]] = field(default_factory=dict)
+    skip_removed: set[int] = field(default_factory=set)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    username TEXT,
+    svalko_pic_period REAL
+);
+CREATE TABLE IF NOT EXISTS skip_counters (
+    partition INTEGER PRIMARY KEY,
+    skipped INTEGER NOT NULL,
+    to_skip INTEGER NOT NULL,
+    wait_left REAL NOT NULL
+);
+"""
+
+
+class StateStore:
+    """
+    SQLite checkpoint of the bot state that has to survive a restart.
+    A snapshot is taken on the event loop every interval seconds and written in a worker
+    thread, only the parts that changed since the previous checkpoint. Writes run one at a
+    time; skip counters of a write that failed are written with the next checkpoint.
+    """
+
+    def __init__(self, path: str, interval: float = 5):
+        self._path = path
+        self._interval = interval
+        self._db: sqlite3.Connection | None = None
+        self._saved = State()
+        self._snapshot: Callable[[], State] | None = None
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+        # skip counter changes drained from the snapshot but not written yet
+        self._unsaved_stats: dict[int, tuple[int, int, float]] = {}
+        self._unsaved_removed: set[int] = set()
+
+    def _open(self) -> State:
+        os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(self._path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+        state = State()
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'update_id'").fetchone()
+        state.update_id = row[0] if row else None
+        state.chats = [ChatState(*row) for row in self._db.execute(
+            'SELECT chat_id, username, svalko_pic_period FROM chats'
+        )]
+        state.skip_stats = {
+            partition: (skipped, to_skip, wait_left)
+            for partition, skipped, to_skip, wait_left in self._db.execute(
+                'SELECT partition, skipped, to_skip, wait_left FROM skip_counters'
+            )
+        }
+        return state
+
+    async def load(self) -> State:
+        state = await asyncio.to_thread(self._open)
+        self._saved = State(state.update_id, state.chats)
+        logger.info(f"state loaded, update_id={state.update_id}, {len(state.chats)} chats")
+        return state
+
+    def start(self, snapshot: Callable[[], State]):
+        self._snapshot = snapshot
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            # not while a checkpoint is written, its thread would go on with the connection
+            async with self._lock:
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            await self.checkpoint()
+        if self._db:
+            self._db.close()
+            self._db = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.checkpoint()
+            except sqlite3.Error:
+                logger.exception("Error when saving state")
+
+    async def checkpoint(self):
+        async with self._lock:
+            state = self._snapshot()
+            saved = self._saved
+
+            update_id = state.update_id if state.update_id != saved.update_id else None
+            chats = state.chats if state.chats != saved.chats else None
+            skip_stats = {
+                partition: counter for partition, counter in self._unsaved_stats.items()
+                if partition not in state.skip_removed
+            }
+            skip_stats.update(state.skip_stats)
+            skip_removed = (self._unsaved_removed | state.skip_removed) - state.skip_stats.keys()
+            if update_id is None and chats is None and not skip_stats and not skip_removed:
+                return
+
+            try:
+                await asyncio.to_thread(self._write, update_id, chats, skip_stats, skip_removed)
+            except sqlite3.Error:
+                self._unsaved_stats, self._unsaved_removed = skip_stats, skip_removed
+                raise
+            self._unsaved_stats, self._unsaved_removed = {}, set()
+            self._saved = State(state.update_id, state.chats)
+
+    def _write(self, update_id: int | None, chats: list[ChatState] | None,
+               skip_stats: dict[int, tuple[int, int, float]], skip_removed: set[int]):
+        with self._db:
+            if update_id is not None:
+                self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('update_id', ?)",
+                                 (update_id,))
+            if chats is not None:
+                self._db.execute('DELETE FROM chats')
+                self._db.executemany(
+                    'INSERT INTO chats (chat_id, username, svalko_pic_period) VALUES (?, ?, ?)',
+                    [(chat.chat_id, chat.username, chat.svalko_pic_period) for chat in chats]
+                )
+            self._db.executemany('DELETE FROM skip_counters WHERE partition = ?',
+                                 [(partition,) for partition in skip_removed])
+            self._db.executemany(
+                'INSERT OR REPLACE INTO skip_counters (partition, skipped, to_skip, wait_left) '
+                'VALUES (?, ?, ?, ?)',
+                [(partition, *counter) for partition, counter in skip_stats.items()]
+            )
+
+
+def move_chats(paths: list[str], owner: Callable[[int], str]):
+    """
+    Move every chat stored in the state databases at paths, with its skip counters, to the
+    database at owner(chat_id) if that is another one. Blocking, for use before the stores open.
+    """
+    for path in paths:
+        db = sqlite3.connect(path)
+        try:
+            db.executescript(_SCHEMA)
+            moves: dict[str, list[tuple]] = {}
+            for row in db.execute('SELECT chat_id, username, svalko_pic_period FROM chats'):
+                target = owner(row[0])
+                if target != path:
+                    moves.setdefault(target, []).append(row)
+
+            for target, chats in moves.items():
+                chat_ids = [(chat[0],) for chat in chats]
+                counters = [row for chat_id, in chat_ids for row in db.execute(
+                    'SELECT partition, skipped, to_skip, wait_left FROM skip_counters WHERE partition = ?',
+                    (chat_id,)
+                )]
+                os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+                target_db = sqlite3.connect(target)
+                try:
+                    target_db.executescript(_SCHEMA)
+                    # a chat the target has already was added there since, so its row is the newer one
+                    with target_db:
+                        target_db.executemany(
+                            'INSERT OR IGNORE INTO chats (chat_id, username, svalko_pic_period) '
+                            'VALUES (?, ?, ?)', chats
+                        )
+                        target_db.executemany(
+                            'INSERT OR IGNORE INTO skip_counters (partition, skipped, to_skip, wait_left) '
+                            'VALUES (?, ?, ?, ?)', counters
+                        )
+                finally:
+                    target_db.close()
+                # removed only once the target has them, a crash in between leaves a copy, not a loss
+                with db:
+                    db.executemany('DELETE FROM chats WHERE chat_id = ?', chat_ids)
+                    db.executemany('DELETE FROM skip_counters WHERE partition = ?', chat_ids)
+                logger.info(f"moved {len(chats)} chats from {path} to {target}")
+        finally:
+            db.close()
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+import random
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable
+
+import aiohttp
+
+from kover_bot.http import CircuitOpen
+from kover_bot.scrapers import Post, Tag
+
+logger = logging.getLogger('root')
+
+
+class TagIndex:
+    """
+    In-memory index of svalko tags, mapping tag names to tag ids.
+    Names are kept casefolded in a sorted list, so a prefix lookup is a single bisect.
+    The index is loaded once and then refreshed in the background every ttl seconds.
+    """
+
+    def __init__(self, fetch: Callable[[], Awaitable[list[Tag]]],
+                 ttl: float = 3600, retry_delay: float = 60):
+        self._fetch = fetch
+        self._ttl = ttl
+        self._retry_delay = retry_delay
+        self._names: list[str] = []
+        self._ids: list[str] = []
+        self._loaded = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._refresh())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def load(self, tags: Iterable[Tag]):
+        index = sorted((tag.name.strip().casefold(), tag.tag_id) for tag in tags)
+        self._names = [name for name, _ in index]
+        self._ids = [tag_id for _, tag_id in index]
+        self._loaded.set()
+
+    def find(self, query: str) -> str | None:
+        """
+        Return the id of the first tag (in casefolded order) whose name starts with query.
+        """
+        query = query.strip().casefold()
+        names = self._names
+        i = bisect_left(names, query)
+        if i < len(names) and names[i].startswith(query):
+            return self._ids[i]
+        return None
+
+    async def lookup(self, query: str, timeout: float = 10) -> str | None:
+        try:
+            await asyncio.wait_for(self._loaded.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Tag index is not loaded yet")
+            return None
+        return self.find(query)
+
+    async def _refresh(self):
+        while True:
+            try:
+                tags = await self._fetch()
+            except CircuitOpen:
+                tags = None
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                logger.exception("Error when fetching svalko tags")
+                tags = None
+            except Exception:
+                logger.exception("Unexpected error when fetching svalko tags")
+                tags = None
+
+            if not tags:
+                await asyncio.sleep(self._retry_delay)
+                continue
+
+            self.load(tags)
+            logger.info(f"tag index loaded, {len(self._names)} tags")
+            await asyncio.sleep(self._ttl)
+
+
+@dataclass(slots=True)
+class _TagPosts:
+    pages: list[int]
+    posts: list[Post] = field(default_factory=list)
+
+
+class TagPostCache:
+    """
+    Per-tag cache of page numbers and harvested posts.
+    Pages are fetched lazily, in random order, and every post on a fetched page is kept,
+    so most samples are served without a page fetch. Posts are sampled without
+    replacement; least recently used tags are evicted once maxsize is exceeded.
+    """
+
+    def __init__(self, fetch_pages: Callable[[str], Awaitable[int]],
+                 fetch_posts: Callable[[str, int], Awaitable[list[Post]]],
+                 maxsize: int = 256, max_fetches: int = 3):
+        self._fetch_pages = fetch_pages
+        self._fetch_posts = fetch_posts
+        self._maxsize = maxsize
+        self._max_fetches = max_fetches
+        self._tags: OrderedDict[str, _TagPosts] = OrderedDict()
+
+    async def _entry(self, tag_id: str) -> _TagPosts:
+        entry = self._tags.get(tag_id)
+        if entry is not None:
+            self._tags.move_to_end(tag_id)
+            return entry
+
+        pages = await self._fetch_pages(tag_id)
+        entry = self._tags.setdefault(tag_id, _TagPosts(pages=self._shuffled_pages(pages)))
+        self._tags.move_to_end(tag_id)
+        while len(self._tags) > self._maxsize:
+            self._tags.popitem(last=False)
+        return entry
+
+    @staticmethod
+    def _shuffled_pages(pages: int) -> list[int]:
+        result = list(range(pages + 1))
+        random.shuffle(result)
+        return result
+
+    async def sample(self, tag_id: str) -> Post | None:
+        entry = await self._entry(tag_id)
+
+        fetches = 0
+        while not entry.posts and fetches < self._max_fetches:
+            if not entry.pages:
+                # every page has been served, start over
+                entry.pages = self._shuffled_pages(await self._fetch_pages(tag_id))
+            entry.posts.extend(await self._fetch_posts(tag_id, entry.pages.pop()))
+            fetches += 1
+
+        if not entry.posts:
+            return None
+
+        posts = entry.posts
+        i = random.randrange(len(posts))
+        posts[i], posts[-1] = posts[-1], posts[i]
+        return posts.pop()
@@ -0,0 +1,44 @@
+import asyncio
+import hmac
+import logging
+from typing import Callable
+
+import telegram
+from aiohttp import web
+
+logger = logging.getLogger('root')
+
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def create_webhook_app(bot: telegram.Bot, on_update: Callable[[telegram.Update], None],
+                       secret_token: str, path: str = '/telegram') -> web.Application:
+    """
+    Application that receives Telegram updates over HTTP, from requests carrying secret_token.
+    Every request is acknowledged as soon as its update is deserialized;
+    on_update is called on the next loop iteration, after the response is on its way.
+    A body that is not an update gets a 400, which Telegram does not redeliver.
+    """
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(
+                request.headers.get(SECRET_TOKEN_HEADER, ''), secret_token
+        ):
+            logger.warning(f"webhook request with a wrong secret token from {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            update = telegram.Update.de_json(await request.json(), bot)
+        except (ValueError, TypeError, KeyError, AttributeError):
+            logger.warning("webhook request with a malformed update")
+            return web.Response(status=400)
+        if update is None or not isinstance(update.update_id, int):
+            logger.warning("webhook request without an update")
+            return web.Response(status=400)
+
+        asyncio.get_running_loop().call_soon(on_update, update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
@@ -4,14 +4,24 @@ import os
 from dotenv import load_dotenv
 
 from kover_bot.bot2 import KoverBot
+from kover_bot.settings import Settings
+from kover_bot.sharding import run_sharded
 
 
 async def main():
     load_dotenv()
-    bot = await KoverBot.create(token=os.getenv("TELEGRAM_TOKEN"))
-    await asyncio.gather(
-        bot.run(),
-    )
+    settings = Settings.from_env()
+    if settings.workers:
+        await run_sharded(os.getenv("TELEGRAM_TOKEN"), settings)
+        return
+
+    bot = await KoverBot.create(token=os.getenv("TELEGRAM_TOKEN"), settings=settings)
+    try:
+        await asyncio.gather(
+            bot.run(),
+        )
+    finally:
+        await bot.close()
 
 
 if __name__ == '__main__':